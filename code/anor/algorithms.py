@@ -21,21 +21,95 @@ Algorithms used to find the optimal/heuristic solution to the queueing model for
 @author: michele
 '''
 
-import commons, anor
+import commons, anor, cache
 import random
-from math import exp, sqrt, ceil, floor
-import decimal
+import time
+from math import exp, sqrt, ceil, floor, log, lgamma
+import multiprocessing
+from collections import OrderedDict
+import numpy
 
 from commons import Reserves
 
 
+class LatencyConstraint():
+    '''
+    Tail-latency constraint: the given percentile of the response time
+    must not exceed bound, see anor.AnnOperRes.response_time. The checks
+    are cached (LRU), as they are more expensive than the evaluation of the
+    cost. Two constraints with the same parameters are equal; the cached
+    checks are not pickled, e.g., when sent to the worker processes.
+    '''
+
+
+    def __init__(self, bound, quantile=0.99, max_size=cache.DEFAULT_MAX_SIZE):
+        '''
+        Constructor
+            * bound: max response time (same time unit as the rates)
+            * quantile: e.g., 0.99 for p99 [default 0.99]
+            * max_size: max number of checks kept in the cache
+        '''
+        if not 0.0 < quantile < 1.0:
+            raise ValueError('quantile must be in (0, 1): %s' % quantile)
+        if max_size < 1:
+            raise ValueError('max_size must be positive: %d' % max_size)
+        self.bound = bound
+        self.quantile = quantile
+        self.max_size = max_size
+        self.__checks = OrderedDict()
+        
+        
+    def satisfied(self, N, nu, res, load):
+        '''
+        Returns True if the configuration meets the constraint
+            * type res: commons.Reserves
+            * type load: commons.Load
+        '''
+        key = (N, nu, load.lam, load.mu, res.m, res.D, res.U)
+        try:
+            ok = self.__checks.pop(key)
+        except KeyError:
+            # the percentile is below the bound iff so is the tail probability
+            # (the costs do not affect the response time)
+            tail = anor.AnnOperRes(N, nu, 1.0, 1.0).tail_probability(res, load, self.bound)
+            ok = tail <= 1.0 - self.quantile
+            if len(self.__checks) >= self.max_size:
+                self.__checks.popitem(last=False)
+        self.__checks[key] = ok
+        return ok
+    
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_LatencyConstraint__checks'] = OrderedDict()
+        return state
+    
+    
+    def __eq__(self, other):
+        return isinstance(other, LatencyConstraint) and \
+            (self.bound, self.quantile, self.max_size) == \
+            (other.bound, other.quantile, other.max_size)
+    
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    
+    def __hash__(self):
+        return hash((self.bound, self.quantile, self.max_size))
+    
+    
+    def __str__(self):
+        return 'p%g <= %.4f' % (100 * self.quantile, self.bound)
+
+
 class Heuristic:
     '''
     Heuristic policy based on a M/M/1 approximation.
     '''
 
 
-    def __init__(self, N, nu, c1, c2, cores=1):
+    def __init__(self, N, nu, c1, c2, cores=1, cost_cache=None, constraint=None):
         '''
         Constructor
             * N: total number of servers
@@ -44,11 +118,18 @@ class Heuristic:
             * c1: holding cost
             * c2: cost for servers
             * cores: number of cores per server 
+            * cost_cache: cache.CostCache (default cache.shared)
+            * constraint: LatencyConstraint [default None]
         '''
         self.N = N
         self.nu = nu
         self.costs = commons.Costs(c1, c2)
         self.cores = cores
+        self.constraint = constraint
+        self.cost_cache = cost_cache
+        if cost_cache is None:
+            self.cost_cache = cache.shared
+        self.evaluations = 0
         
         
     def computeN(self, load):
@@ -82,14 +163,16 @@ class Heuristic:
         return max(tmp1, tmp2);
     
     
-    def solve(self, res, load):
+    def evaluate(self, res, load):
         '''
         Produces a solution for the given number of reserves and load
             * type res: anor.commons.Reserves
             * type load: anor.commons.Load
             * rtype: anor.commons.Solution
         '''
-        return anor.AnnOperRes(self.N, self.nu, self.costs.c1, self.costs.c2).cost(res, load)
+        self.evaluations += 1
+        return self.cost_cache.cost(self.N, self.nu, self.costs, res, load, 
+                                    anor.AnnOperRes(self.N, self.nu, self.costs.c1, self.costs.c2).cost)
     
     
     def compute_queue_thresholds(self, load, m):
@@ -115,7 +198,7 @@ class Heuristic:
             D, U = self.compute_queue_thresholds(load, m)
             
             res = commons.Reserves(m, D, U)
-            sol = self.solve(res, load)
+            sol = self.evaluate(res, load)
         else:
             n1 = n + diff
             n2 = n - diff
@@ -131,7 +214,7 @@ class Heuristic:
                 D, U = self.compute_queue_thresholds(load, m)
             
                 res1 = commons.Reserves(m, D, U)
-                c2 = self.solve(res1, load)
+                c2 = self.evaluate(res1, load)
                 
             if n1 < self.N:
                 m = max(0, self.N - n1)
@@ -139,25 +222,33 @@ class Heuristic:
                 D, U = self.compute_queue_thresholds(load, m)
             
                 res2 = commons.Reserves(m, D, U)
-                c1 = self.solve(res2, load)
+                c1 = self.evaluate(res2, load)
                 
             if c1 == None and c2 == None:
                 raise RuntimeError('Unable to find solution!')
             
+            # c2 is the solution for res1, c1 the one for res2
             if res1 == None:
-                sol = self.solve(res2, load)
+                sol = c1
             elif res2 == None:
-                sol = self.solve(res1, load)
+                sol = c2
             else:
-                c1 = self.solve(res1, load)
-                c2 = self.solve(res2, load)
-                if c1.__cmp__(c2) < 0:
-                    sol = c1
-                else:
+                if c2.cost < c1.cost:
                     sol = c2
+                else:
+                    sol = c1
         
         if sol == None:
-            raise RuntimeError("Null result")            
+            raise RuntimeError("Null result")
+        
+        # fewer reserves until the latency is acceptable (all the servers
+        # always on, if the constraint cannot be met)
+        m = sol.get_m()
+        while self.constraint is not None and m > 0 and \
+                not self.constraint.satisfied(self.N, self.nu, sol.reserves, load):
+            m = max(0, m - self.cores)
+            D, U = self.compute_queue_thresholds(load, m)
+            sol = self.evaluate(commons.Reserves(m, D, U), load)
         return sol
     
         
@@ -172,7 +263,119 @@ class Heuristic:
         U = self.computeU(load, n)
         
         res = commons.Reserves(self.m, D, U)
-        return self.solve(res, load)
+        return self.evaluate(res, load)
+    
+    
+    def solve(self, load, deadline=None):
+        '''
+        Anytime interface, see SimulatedAnnealing.solve. The heuristic
+        requires at most two evaluations, so the deadline is ignored.
+            * type load: commons.Load
+            * param deadline: ignored
+            * rtype: commons.Result
+        '''
+        start = time.time()
+        self.evaluations = 0
+        sol = self.heuristic(load)
+        return commons.Result(sol, sol, self.evaluations, time.time() - start, True)
+
+
+# Default stop criteria used by Exhaustive when growing the upper threshold
+EXHAUSTIVE_WINDOW = 10
+EXHAUSTIVE_EPS = 1e-15
+
+# Default stop criterion used by Unimodal when looking for the range of U
+UNIMODAL_TOL = 1e-9
+
+
+def _reach_threshold(n, rho, eps):
+    '''
+    Gets the smallest U >= n such that the M/M/n queue with load rho holds
+    at least U jobs with probability smaller than eps, i.e., with the
+    reserves off the queue reaches U with negligible probability
+        * rtype: int, or None if the queue is not stable (n <= rho)
+    '''
+    if n <= rho:
+        return None
+    if rho <= 0.0:
+        return n
+    lterms = [j * log(rho) - lgamma(j + 1) for j in xrange(n)]
+    lterms.append(n * log(rho) - lgamma(n + 1) - log(1.0 - rho / n))
+    ltail = lterms[-1] - numpy.logaddexp.reduce(lterms) # log P(queue >= n)
+    if ltail < log(eps):
+        return n
+    return n + int(ceil((log(eps) - ltail) / log(rho / n)))
+
+
+def _exhaustive_slab(args):
+    '''
+    Evaluates the configurations with the given number of reserves, for
+    increasing values of U (executed by the worker processes of Exhaustive).
+    If the N - m servers always on can handle the load, U grows until the
+    probability that they reach U is smaller than eps (see
+    _reach_threshold): the configurations with larger thresholds only
+    differ in states with negligible probability. Otherwise the threshold
+    is always reached, and U grows until the best cost over D increases
+    for window consecutive values. U also stops at max_u (if not None) or
+    when the cost cannot be computed. With a constraint
+    (LatencyConstraint), the best configuration that meets it is returned
+    (the stop criteria do not change).
+        * rtype: tuple (m, cost, D, U, evaluations, largest U evaluated)
+    '''
+    N, nu, c1, c2, lam, mu, m, min_u, window, eps, max_u, constraint = args
+    evaluator = anor.AnnOperRes(N, nu, c1, c2)
+    load = commons.Load(lam, mu)
+    stop_u = _reach_threshold(N - m, load.get_load(), eps)
+    best = (float('inf'), 0, 0)
+    evaluations = 0
+    prev = None
+    rising = 0
+    u = max(min_u, 1) # D < U
+    last_u = u - 1
+    go = max_u is None or u < max_u
+    while go:
+        hi = u + window
+        if max_u is not None:
+            hi = min(hi, max_u)
+        # all the (D, U) pairs, D < U, sorted by U and then by D
+        u_grid = numpy.concatenate([numpy.repeat(k, k) for k in xrange(u, hi)])
+        d_grid = numpy.concatenate([numpy.arange(0, k) for k in xrange(u, hi)])
+        with numpy.errstate(all='ignore'):
+            costs = evaluator.cost_batch(load, numpy.repeat(m, len(u_grid)), d_grid, u_grid)[0]
+        evaluations += len(u_grid)
+        
+        start = 0
+        for k in xrange(u, hi):
+            i = start + int(numpy.argmin(costs[start:start + k]))
+            start += k
+            cost = costs[i]
+            last_u = k
+            if not numpy.isfinite(cost):
+                go = False
+                break
+            if cost < best[0]:
+                if constraint is None:
+                    best = (float(cost), int(d_grid[i]), k)
+                else:
+                    # the cheapest value of D that meets the constraint
+                    first = start - k
+                    for i in first + numpy.argsort(costs[first:start], kind='mergesort'):
+                        if costs[i] >= best[0]:
+                            break
+                        if constraint.satisfied(N, nu, commons.Reserves(m, int(d_grid[i]), k),
+                                                load):
+                            best = (float(costs[i]), int(d_grid[i]), k)
+                            break
+            if prev is not None:
+                rising = rising + 1 if cost > prev else 0
+            if rising >= window or (stop_u is not None and k >= stop_u):
+                go = False
+                break
+            prev = cost
+        u = hi
+        if max_u is not None and u >= max_u:
+            go = False
+    return (m, best[0], best[1], best[2], evaluations, last_u)
 
 
 class Exhaustive():
@@ -181,7 +384,7 @@ class Exhaustive():
     '''
 
 
-    def __init__(self, N, nu, c1, c2):
+    def __init__(self, N, nu, c1, c2, cost_cache=None, constraint=None):
         '''
         Constructor
             * N: total number of servers
@@ -189,38 +392,334 @@ class Exhaustive():
               on average 1/nu time units to be switched on)
             * c1: holding cost
             * c2: cost for servers
+            * cost_cache: cache.CostCache (default cache.shared)
+            * constraint: LatencyConstraint [default None]
         '''
         self.N = N
         self.nu = nu
         self.costs = commons.Costs(c1, c2)
+        self.constraint = constraint
+        self.cost_cache = cost_cache
+        if cost_cache is None:
+            self.cost_cache = cache.shared
+        # statistics of the last search
+        self.evaluations = 0 # configurations evaluated
+        self.skipped = 0 # configurations pruned
     
     
     def cost(self, res, load):
         '''
         Returns an object of type Solution
         '''
-        return anor.AnnOperRes(self.N, self.nu, self.costs.c1, self.costs.c2).cost(res, load)
+        return self.cost_cache.cost(self.N, self.nu, self.costs, res, load, 
+                                    anor.AnnOperRes(self.N, self.nu, self.costs.c1, self.costs.c2).cost)
     
-    def exhaustive_search(self, load):
+    def exhaustive_search(self, load, processes=1, progress=None, prune=True,
+                          window=EXHAUSTIVE_WINDOW, eps=EXHAUSTIVE_EPS, max_u=None):
+        '''
+        Evaluates the configurations (m, D, U), with D < U, and returns the
+        best one. For each value of m, the upper threshold grows from the
+        load until larger values cannot improve the cost, see
+        _exhaustive_slab; each block of values of U is evaluated as a single
+        batch, see anor.AnnOperRes.cost_batch.
+        
+        With pruning, the values of m whose lower bound is larger than the
+        best cost found so far are skipped. The lower bound is the cost of
+        the M/M/N queue (no reserves, i.e., the smallest possible holding
+        cost) minus the cost of m servers (reserves always off). It only
+        holds for U >= N - m - 1 (see AnnOperRes.cost1), so the smaller
+        values of U are evaluated anyway. The value of m used by the
+        heuristic is evaluated first, then the others in order of
+        increasing lower bound. The result is the same as without pruning;
+        self.evaluations and self.skipped report how many configurations
+        have been evaluated and skipped (the latter assuming the largest U
+        reached by the evaluated values of m).
+            * type load: commons.Load
+            * param processes: number of worker processes; the values of m
+              are distributed among them. If None, all the cores are used
+              [default 1, no worker processes]
+            * param progress: function (done, total, best) called each time
+              a value of m has been evaluated, where best is the best
+              commons.Solution found so far [default None]
+            * param prune: skip the values of m that cannot improve the
+              best solution [default True]
+            * param window: if the servers always on cannot handle the load,
+              stop increasing U after this many consecutive values with
+              increasing cost [default 10]
+            * param eps: otherwise, stop increasing U once they reach it
+              with probability smaller than eps [default 1e-15]
+            * param max_u: U is always smaller than max_u, if not None
+              [default None]
+            * rtype: commons.Solution
+        '''
         rho = load.get_load()
         min_u = int(floor(rho))
-        best = self.cost(commons.Reserves(0, 0, 0), load)
-        for m in xrange(0, self.N):
-            n = self.N - m
-            for u in xrange(min_u, 80):
-                for d in xrange(0, u):
-                    # see comment at the beginning of cost1.m
-                    if d == u and u < n - 1:
-                        continue
-                    res = commons.Reserves(m, d, u)
-                    tmp = self.cost(res, load)
-                    # print tmp.__str__()
-                    if tmp.__cmp__(best) < 0:
-                        best = tmp
+        best = anor.AnnOperRes(self.N, self.nu, self.costs.c1, self.costs.c2).cost0(load)
+        self.evaluations = 0
+        self.skipped = 0
+        if (max_u is not None and max(min_u, 1) >= max_u) or self.N < 2:
+            return best
+        if self.constraint is not None and \
+                not self.constraint.satisfied(self.N, self.nu, commons.Reserves(), load):
+            return best # no reserves gives the lowest latency
+        
+        c0 = best.get_cost()
+        best_m = 0
+        state = {'pruned': 0, 'pruned_evaluations': 0, 'last_u': 0}
+        
+        def task(m, pruned=False):
+            top = max_u
+            if pruned:
+                # only the thresholds where the lower bound does not hold
+                top = self.N - m - 1 if max_u is None else min(max_u, self.N - m - 1)
+                if max(min_u, 1) >= top:
+                    return None
+            return (self.N, self.nu, self.costs.c1, self.costs.c2, load.lam, load.mu, m, min_u, 
+                    window, eps, top, self.constraint)
+        
+        def lower_bound(m):
+            return c0 - m * self.costs.c2
+        
+        def merge(result, pruned=False):
+            m, cost, d, u, evaluations, last_u = result
+            self.evaluations += evaluations
+            if pruned:
+                state['pruned_evaluations'] += evaluations
+            else:
+                state['last_u'] = max(state['last_u'], last_u)
+            # ties are broken in favour of the smallest m, as in the serial search
+            if cost < best.get_cost() or (cost == best.get_cost() and 0 < m < best_m):
+                return commons.Solution(cost, commons.Reserves(m, d, u)), m
+            return best, best_m
+        
+        candidates = range(self.N - 1, 0, -1) # increasing lower bound
+        if prune:
+            seed = self.N - Heuristic(self.N, self.nu, self.costs.c1, self.costs.c2).computeN(load)
+            seed = min(max(seed, 1), self.N - 1)
+            best, best_m = merge(_exhaustive_slab(task(seed)))
+            candidates.remove(seed)
+            if progress is not None:
+                progress(1, self.N - 1, best)
+        
+        done = self.N - 1 - len(candidates) # values of m evaluated
+        if processes == 1:
+            for m in candidates:
+                # the best solution may have improved since the candidates were selected
+                pruned = prune and lower_bound(m) > best.get_cost()
+                args = task(m, pruned)
+                if pruned:
+                    state['pruned'] += 1
+                if args is not None:
+                    best, best_m = merge(_exhaustive_slab(args), pruned)
+                done += 1
+                if progress is not None:
+                    progress(done, self.N - 1, best)
+        else:
+            pruned = set(m for m in candidates if prune and lower_bound(m) > best.get_cost())
+            state['pruned'] += len(pruned)
+            tasks = [task(m, m in pruned) for m in candidates]
+            done += tasks.count(None)
+            pool = multiprocessing.Pool(processes)
+            try:
+                for result in pool.imap_unordered(_exhaustive_slab,
+                                                  [args for args in tasks if args is not None]):
+                    best, best_m = merge(result, result[0] in pruned)
+                    done += 1
+                    if progress is not None:
+                        progress(done, self.N - 1, best)
+            finally:
+                pool.close()
+                pool.join()
+        self.skipped = state['pruned'] * sum(xrange(max(min_u, 1), state['last_u'] + 1)) - \
+            state['pruned_evaluations']
         return best
+    
+    
+    def solve(self, load, deadline=None, processes=1):
+        '''
+        Anytime interface, see SimulatedAnnealing.solve. The search is not
+        interruptible, so the deadline is ignored.
+            * type load: commons.Load
+            * param deadline: ignored
+            * param processes: see exhaustive_search
+            * rtype: commons.Result
+        '''
+        start = time.time()
+        baseline = Heuristic(self.N, self.nu, self.costs.c1, self.costs.c2, 1,
+                             self.cost_cache, self.constraint).heuristic(load)
+        sol = self.exhaustive_search(load, processes)
+        return commons.Result(sol, baseline, self.evaluations, time.time() - start, True)
+
+
+
+# Golden ratio, used by Unimodal
+GOLDEN = (1.0 + sqrt(5.0)) / 2.0
+
+
+def _golden_section(f, lo, hi):
+    '''
+    Golden-section search of the minimum of the unimodal function f over
+    the integers in [lo, hi]; ties are broken in favour of the smallest
+    argument. f should cache its values, as the points are often evaluated
+    twice because of the rounding.
+        * rtype: the argument of the minimum
+    '''
+    a, b = lo, hi
+    while b - a > 3:
+        c = b - int(round((b - a) / GOLDEN))
+        d = max(a + int(round((b - a) / GOLDEN)), c + 1)
+        if f(c) <= f(d):
+            b = d
+        else:
+            a = c
+    return min(xrange(a, b + 1), key=lambda x: (f(x), x))
+
+
+class Unimodal():
+    '''
+    Structured search, exploiting the shape of the cost function: for each
+    value of m and U the cost is minimised over D by a golden-section
+    search, for each value of m the result is minimised over U by another
+    golden-section search, and the resulting cost is minimised over m by a
+    third one. The number of evaluations is O(log N * log U * log U)
+    instead of O(N * U^2); the result is optimal as long as the costs are
+    unimodal (in D, apart from its end points), see benchmark.check_unimodal.
+    '''
+
+
+    def __init__(self, N, nu, c1, c2, window=EXHAUSTIVE_WINDOW, tol=UNIMODAL_TOL,
+                 max_u=None):
+        '''
+        Constructor
+            * N: total number of servers
+            * nu: rate required to power on servers
+            * c1: holding cost
+            * c2: cost for servers
+            * window: the search over U stops when the cost rises only
+              after a step of at least window values [default 10]
+            * tol: relative change of the cost considered flat when looking
+              for the upper end of the range of U [default 1e-9]
+            * max_u: U is always smaller than max_u, if not None
+              [default None]
+        '''
+        self.N = N
+        self.nu = nu
+        self.costs = commons.Costs(c1, c2)
+        self.window = window
+        self.tol = tol
+        self.max_u = max_u
+        self.evaluator = anor.AnnOperRes(N, nu, c1, c2)
+        self.incremental = None # anor.IncrementalCost for the current load
+        self.evaluations = 0 # configurations evaluated by the last search
+        
         
+    def __best_d(self, m, u, memo):
+        '''
+        Gets (cost, D) for the best lower threshold given m and U. The cost
+        may also have a minimum at either end of the range of D (D = 0 or
+        D = U - 1), so both ends are evaluated besides the golden-section
+        search.
+        '''
+        key = (m, u)
+        if key not in memo:
+            costs = {}
+            def f(d):
+                if d not in costs:
+                    cost = self.incremental.cost(commons.Reserves(m, d, u)).get_cost()
+                    if cost != cost: # NaN
+                        cost = float('inf')
+                    costs[d] = cost
+                return costs[d]
+            d = _golden_section(f, 0, u - 1)
+            d = min((d, 0, u - 1), key=lambda x: (f(x), x))
+            self.evaluations += len(costs)
+            memo[key] = (costs[d], d)
+        return memo[key]
+    
+    
+    def __best_u(self, m, min_u):
+        '''
+        Gets (cost, D, U) for the best thresholds given m. U is probed at
+        min_u + 1, 2, 4, ... until the cost is flat (it has converged) or
+        it rises after a step of at least window values (small values of U
+        may show a transient bump); the best probe and its neighbours
+        bracket the range searched by golden section.
+        '''
+        memo = {}
+        f = lambda u: self.__best_d(m, u, memo)[0]
+        top = self.max_u - 1 if self.max_u is not None else None
+        probes = [min_u]
+        values = [f(min_u)]
+        step = 1
+        while probes[-1] != top:
+            u = min_u + step
+            if top is not None:
+                u = min(u, top)
+            prev = values[-1]
+            cur = f(u)
+            probes.append(u)
+            values.append(cur)
+            if cur == float('inf') or abs(cur - prev) <= self.tol * abs(prev):
+                break
+            if cur > prev and step >= self.window:
+                break
+            step *= 2
+        i = values.index(min(values))
+        u = _golden_section(f, probes[max(i - 1, 0)], probes[min(i + 1, len(probes) - 1)])
+        if f(u) > values[i]:
+            u = probes[i]
+        cost, d = memo[(m, u)]
+        return cost, d, u
         
         
+    def search(self, load):
+        '''
+        Gets the best configuration
+            * type load: commons.Load
+            * rtype: commons.Solution
+        '''
+        self.evaluations = 0
+        best = self.evaluator.cost0(load)
+        min_u = max(int(floor(load.get_load())), 1) # D < U
+        self.incremental = anor.IncrementalCost(self.N, self.nu, self.costs.c1,
+                                                self.costs.c2, load)
+        if self.N < 2 or (self.max_u is not None and min_u >= self.max_u):
+            return best
+        
+        memo = {}
+        def f(m):
+            if m not in memo:
+                memo[m] = self.__best_u(m, min_u)
+            return memo[m][0]
+        m = _golden_section(f, 1, self.N - 1)
+        cost, d, u = memo[m]
+        if cost < best.get_cost():
+            best = commons.Solution(cost, commons.Reserves(m, d, u))
+        return best
+    
+    
+    def solve(self, load, deadline=None):
+        '''
+        Anytime interface, see SimulatedAnnealing.solve. The search is not
+        interruptible, so the deadline is ignored.
+            * type load: commons.Load
+            * param deadline: ignored
+            * rtype: commons.Result
+        '''
+        start = time.time()
+        baseline = Heuristic(self.N, self.nu, self.costs.c1, self.costs.c2).heuristic(load)
+        sol = self.search(load)
+        return commons.Result(sol, baseline, self.evaluations, time.time() - start, True)
+
+
+
+# Reasons why SimulatedAnnealing.search stops
+STOP_MAX_ITER = 'max_iter'
+STOP_ZERO_COST = 'zero_cost'
+STOP_DEADLINE = 'deadline'
+STOP_STAGNATION = 'stagnation'
+STOP_TEMPERATURE = 'temperature'
+
 
 class SimulatedAnnealing():
     '''
@@ -228,7 +727,8 @@ class SimulatedAnnealing():
     '''
 
 
-    def __init__(self, N, nu, c1, c2, cores=1):
+    def __init__(self, N, nu, c1, c2, cores=1, cost_cache=None, patience=None,
+                 tolerance=0.0, min_temp=0.0, constraint=None, max_u=None):
         '''
         Constructor
             * N: total number of servers
@@ -237,12 +737,50 @@ class SimulatedAnnealing():
             * c1: holding cost
             * c2: cost for servers
             * cores: (default 1) increment/decrement of m 
+            * cost_cache: cache.CostCache (default cache.shared)
+            * patience: stop after this many iterations without improvements
+              [default None, never]
+            * tolerance: improvements of the best cost smaller than
+              tolerance * cost (relative) do not count for patience
+              [default 0.0]
+            * min_temp: stop when the temperature falls below this value
+              [default 0.0]
+            * constraint: LatencyConstraint; the configurations that do not
+              meet it have infinite cost [default None]
+            * max_u: upper limit of U for the neighbours; from a state above
+              it, U is not increased [default None, no limit]
         '''
         self.N = N
         self.nu = nu
         self.cost = commons.Costs(c1, c2)
         self.time = 0
         self.cores = cores
+        # cooling schedule
+        self.max_iter = 25000
+        self.max_temp = 10000.0
+        self.temp_change = 0.999
+        # if not None, (Reserves, radius): the neighbours must be within
+        # radius (cores for m) from the given reserves
+        self.region = None
+        # stop criteria
+        self.patience = patience
+        self.tolerance = tolerance
+        self.min_temp = min_temp
+        self.constraint = constraint
+        self.max_u = max_u
+        # statistics of the last search, see get_statistics
+        self.accepted = 0
+        self.iteration_of_best = 0
+        self.time_to_best = 0.0
+        self.stop_reason = None
+        self.rng = random # source of random numbers (module random or random.Random)
+        self.state = None # current state at the end of the last search
+        self.evaluator = None
+        self.evaluations = 0
+        self.expired = False # True if the last search stopped at the deadline
+        self.cost_cache = cost_cache
+        if cost_cache is None:
+            self.cost_cache = cache.shared
         
         
     def __str__(self):
@@ -253,13 +791,53 @@ class SimulatedAnnealing():
         Gets the number of iterations made by the algorithm
         '''
         return self.time
+    
+    
+    def get_statistics(self):
+        '''
+        Gets the statistics of the last search
+            * rtype: dictionary with keys
+                * iterations: number of iterations
+                * accepted: number of accepted moves
+                * acceptance_ratio: accepted / iterations
+                * iteration_of_best: iteration when the best solution was found
+                * time_to_best: seconds elapsed before finding the best solution
+                * stop_reason: one of the STOP_* constants
+        '''
+        ratio = 0.0
+        if self.time > 0:
+            ratio = float(self.accepted) / self.time
+        return {'iterations': self.time,
+                'accepted': self.accepted,
+                'acceptance_ratio': ratio,
+                'iteration_of_best': self.iteration_of_best,
+                'time_to_best': self.time_to_best,
+                'stop_reason': self.stop_reason}
+    
+    
+    def evaluate(self, res, load):
+        '''
+        Evaluates the cost function for the given parameters, reusing the
+        partial results of the previous evaluations with the same load.
+        '''
+        self.evaluations += 1
+        sol = self.cost_cache.cost(self.N, self.nu, self.cost, res, load, self.__incremental)
+        if self.constraint is not None and \
+                not self.constraint.satisfied(self.N, self.nu, res, load):
+            return commons.Solution(float('inf'), res)
+        return sol
+    
+    
+    def __incremental(self, res, load):
+        if self.evaluator is None or not self.evaluator.same_load(load):
+            self.evaluator = anor.IncrementalCost(self.N, self.nu, self.cost.c1, self.cost.c2, load)
+        return self.evaluator.cost(res)
         
     
     def __def_solution(self, load):
         '''
-        Creates the default solution.
-        It is not possible to use the ANOR heuristic here because it tends
-        to use very large upper thresholds, which might cause overflow.
+        Creates the default solution: enough servers always on to handle
+        the load, and U = N.
         '''
         n = int(round(load.get_load() + 0.5))
         if n % self.cores != 0:
@@ -269,7 +847,7 @@ class SimulatedAnnealing():
             
         U = self.N
         D = n - 1
-        return Reserves(self.N - n, D, U).create_solution(self.N, self.nu, self.cost, load)
+        return self.evaluate(Reserves(self.N - n, D, U), load)
     
     
     def create_neighbor(self, cur_state, load):
@@ -282,7 +860,7 @@ class SimulatedAnnealing():
         m = cur_state.get_m()
         d = cur_state.get_d()
         u = cur_state.get_u()
-        max_u = self.N * 3
+        max_u = self.max_u
         tmp = []
         
         if m > self.cores and u >= (self.N - (m - self.cores) - 1):
@@ -303,7 +881,7 @@ class SimulatedAnnealing():
         if u >= (self.N - m - 2) and (u - 1) >= d:
             tmp.append(Reserves(m, d, u - 1))
             
-        if u < max_u:
+        if max_u is None or u < max_u:
             tmp.append(Reserves(m, d, u + 1))
             tmp.append(Reserves(m, d + 1, u + 1))
             
@@ -315,23 +893,38 @@ class SimulatedAnnealing():
         if u - 1 >= d and u - 1 >= (self.N - (m + self.cores) - 1) and (m + self.cores) < self.N:
             tmp.append(Reserves(m + self.cores, d, u - 1)) 
             
-        selected =  random.choice(tmp)
-        if selected.U > max_u:
-            raise RuntimeError(selected.__str__())      
-        return selected.create_solution(self.N, self.nu, self.cost, load)
+        if self.region is not None:
+            center, radius = self.region
+            near = [res for res in tmp if abs(res.m - center.m) <= radius * self.cores
+                    and abs(res.D - center.D) <= radius and abs(res.U - center.U) <= radius]
+            if len(near) > 0:
+                tmp = near
+        
+        if max_u is not None:
+            # e.g., when the initial state is above the limit
+            below = [res for res in tmp if res.U <= max_u]
+            if len(below) > 0:
+                tmp = below
+            
+        selected =  self.rng.choice(tmp)
+        return self.evaluate(selected, load)
     
     
         
-    def search(self, load, initial_state=None):
+    def search(self, load, initial_state=None, deadline=None):
         '''
-        Simulated annealing algorithm.
+        Simulated annealing algorithm. The search stops after max_iter
+        iterations, or earlier because of the deadline or of the stop
+        criteria given to the constructor.
         * type load: commons.Load
         * param load: the load parameters
+        * param deadline: if not None, the search stops at this time
+          (as returned by time.time()) [default None]
         * rtype: commons.Solution
         '''
-        max_iter = 25000
-        max_temp = 10000.0
-        temp_change = 0.999
+        max_iter = self.max_iter
+        max_temp = self.max_temp
+        temp_change = self.temp_change
         
         temp = max_temp
         
@@ -344,138 +937,660 @@ class SimulatedAnnealing():
         s = initial_state
         ebest = initial_state.get_cost()
         
-        
-        while self.time < max_iter and s.get_cost() > 0.0:
+        start = time.time()
+        self.time = 0
+        self.accepted = 0
+        self.iteration_of_best = 0
+        self.time_to_best = 0.0
+        self.stop_reason = STOP_MAX_ITER
+        self.expired = False
+        stale = 0 # iterations since the last improvement
+        while self.time < max_iter:
+            if s.get_cost() <= 0.0:
+                self.stop_reason = STOP_ZERO_COST
+                break
+            if deadline is not None and time.time() >= deadline:
+                self.expired = True
+                self.stop_reason = STOP_DEADLINE
+                break
+            if self.patience is not None and stale >= self.patience:
+                self.stop_reason = STOP_STAGNATION
+                break
+            if temp < self.min_temp:
+                self.stop_reason = STOP_TEMPERATURE
+                break
+            
             snew = self.create_neighbor(s, load)
-            if snew.get_d == snew.get_u:
-                if snew.get_u >= (self.N - snew.get_m -1):
-                    enew = snew.get_cost()
-                    temp = temp * temp_change
-                    
-                    delta_e = exp(s.get_cost() - snew.get_cost()) / temp
-                    if delta_e > random.random():
-                        s = snew
-                    if enew < ebest:
-                        sbest = snew
-                        ebest = enew
-            else:
-                enew = snew.get_cost()
-                temp = temp * temp_change
-                
-                tmp1 = exp(s.get_cost() - snew.get_cost()) / temp
-                if tmp1 > random.random():
-                    s = snew
-                if enew < ebest:
-                    sbest = snew
-                    ebest = enew
-                
             self.time += 1
+            stale += 1
+            # cost1 requires N - m - 1 <= K when D = U = K
+            if snew.get_d() == snew.get_u() and snew.get_u() < (self.N - snew.get_m() - 1):
+                continue
+            
+            enew = snew.get_cost()
+            temp = temp * temp_change
+            if self.__accept(s.get_cost() - enew, temp):
+                s = snew
+                self.accepted += 1
+            if enew < ebest:
+                # the first feasible state (ebest is inf) is an improvement
+                if ebest == float('inf') or ebest - enew > self.tolerance * abs(ebest):
+                    stale = 0
+                sbest = snew
+                ebest = enew
+                self.iteration_of_best = self.time
+                self.time_to_best = time.time() - start
             
+        self.state = s
         return sbest
+    
+    
+    def __accept(self, delta_e, temp):
+        '''
+        Metropolis criterion: improvements are always accepted, worse
+        solutions with probability exp(delta_e / temp). Moves between
+        infeasible solutions (infinite cost, delta_e is nan) are accepted.
+        '''
+        if delta_e != delta_e:
+            return True
+        return delta_e >= 0.0 or exp(delta_e / temp) > self.rng.random()
+    
+    
+    def solve(self, load, deadline=None, initial_state=None):
+        '''
+        Anytime interface: runs a new search and returns the best solution
+        found when either the search completes or the deadline expires.
+            * type load: commons.Load
+            * param deadline: time (as returned by time.time()) when the
+              search has to stop [default None, no deadline]
+            * type initial_state: commons.Solution
+            * rtype: commons.Result
+        '''
+        start = time.time()
+        self.evaluations = 0
+        # before the search, which then gets what is left before the deadline
+        baseline = Heuristic(self.N, self.nu, self.cost.c1, self.cost.c2, self.cores,
+                             self.cost_cache, self.constraint).heuristic(load)
+        sol = self.search(load, initial_state, deadline)
+        return commons.Result(sol, baseline, self.evaluations, time.time() - start,
+                              not self.expired)
                 
         
         
         
         
+# Relative change of the arrival rate above which WarmStart runs a full search
+WARM_FULL_CHANGE = 0.5
+# Min number of iterations and radius of the warm started searches
+WARM_MIN_ITER = 1000
+WARM_MIN_RADIUS = 2
+# Final temperature of the default cooling schedule of SimulatedAnnealing
+WARM_FINAL_TEMP = 10000.0 * 0.999 ** 25000
+
+
+class WarmStart():
+    '''
+    Re-optimization across reconfiguration epochs. The previous solution is
+    used as the initial state of a simulated annealing search whose length,
+    initial temperature and neighbourhood shrink with the relative change
+    of the arrival rate since the previous epoch.
+    '''
+
+
+    def __init__(self, N, nu, c1, c2, cores=1, cost_cache=None):
+        '''
+        Constructor, see SimulatedAnnealing
+        '''
+        self.annealing = SimulatedAnnealing(N, nu, c1, c2, cores, cost_cache)
+        self.last_lam = None
+        self.last = None # commons.Solution
+        
+        
+    def reset(self):
+        '''
+        Forgets the previous solution: the next search starts from scratch
+        '''
+        self.last_lam = None
+        self.last = None
+        
+        
+    def solve(self, load, deadline=None):
+        '''
+        Anytime interface, see SimulatedAnnealing.solve
+            * type load: commons.Load
+            * param deadline: time (as returned by time.time()) when the
+              search has to stop [default None, no deadline]
+            * rtype: commons.Result
+        '''
+        sa = self.annealing
+        sa.max_iter = 25000
+        sa.max_temp = 10000.0
+        sa.temp_change = 0.999
+        sa.region = None
+        initial = None
+        
+        if self.last is not None:
+            change = abs(load.lam - self.last_lam) / float(self.last_lam)
+            scale = min(1.0, change / WARM_FULL_CHANGE)
+            if scale < 1.0:
+                sa.max_iter = max(WARM_MIN_ITER, int(scale * 25000))
+                sa.max_temp = max(WARM_FINAL_TEMP * 10, scale * 10000.0)
+                # same final temperature as the full search
+                sa.temp_change = (WARM_FINAL_TEMP / sa.max_temp) ** (1.0 / sa.max_iter)
+                radius = max(WARM_MIN_RADIUS, int(ceil(scale * sa.N / sa.cores)))
+                sa.region = (self.last.reserves, radius)
+                initial = sa.evaluate(self.last.reserves, load)
+            
+        result = sa.solve(load, deadline, initial)
+        self.last_lam = load.lam
+        self.last = result.solution
+        return result
+
+
+
+
+def _tempering_chain(args):
+    '''
+    Runs a chain of ParallelTempering at a fixed temperature (executed by
+    the worker processes)
+        * rtype: tuple (final state, best state, evaluations), where the
+          states are tuples (m, D, U, cost)
+    '''
+    N, nu, c1, c2, cores, lam, mu, state, temp, iterations, seed = args
+    # one annealing object per process, to reuse its partial results
+    key = (N, nu, c1, c2, cores)
+    sa = _tempering_annealing.get(key)
+    if sa is None:
+        sa = SimulatedAnnealing(N, nu, c1, c2, cores)
+        _tempering_annealing[key] = sa
+    sa.rng = random.Random(seed)
+    sa.max_iter = iterations
+    sa.max_temp = temp
+    sa.temp_change = 1.0
+    sa.evaluations = 0
+    load = commons.Load(lam, mu)
+    best = sa.search(load, sa.evaluate(commons.Reserves(state[0], state[1], state[2]), load))
+    
+    def pack(sol):
+        return (sol.get_m(), sol.get_d(), sol.get_u(), sol.get_cost())
+    return pack(sa.state), pack(best), sa.evaluations
+
+_tempering_annealing = {}
+
+
+class ParallelTempering():
+    '''
+    Multi-chain simulated annealing (replica exchange). Each chain runs at
+    a fixed temperature, in a separate process; after each round the
+    states of chains with adjacent temperatures are swapped with the
+    Metropolis probability. The temperatures are geometrically spaced
+    between min_temp and max_temp.
+    '''
+
+
+    def __init__(self, N, nu, c1, c2, cores=1, chains=None, min_temp=1e-3, max_temp=1.0,
+                 rounds=50, sweep=500, seed=0):
+        '''
+        Constructor
+            * N: total number of servers
+            * nu: rate required to power on servers
+            * c1: holding cost
+            * c2: cost for servers
+            * cores: (default 1) increment/decrement of m
+            * chains: number of chains [default: number of cores]
+            * min_temp, max_temp: temperature of the coldest/hottest chain
+            * rounds: number of rounds (each followed by the swaps)
+            * sweep: iterations of each chain per round
+            * seed: the chain i uses seeds derived from (seed, i, round), so
+              the results do not depend on the scheduling of the processes
+        '''
+        self.N = N
+        self.nu = nu
+        self.costs = commons.Costs(c1, c2)
+        self.cores = cores
+        if chains is None:
+            chains = multiprocessing.cpu_count()
+        if chains < 1:
+            raise ValueError('chains must be positive: %d' % chains)
+        self.chains = chains
+        if chains == 1:
+            self.temps = [min_temp]
+        else:
+            ratio = (max_temp / min_temp) ** (1.0 / (chains - 1))
+            self.temps = [min_temp * ratio ** i for i in xrange(chains)]
+        self.rounds = rounds
+        self.sweep = sweep
+        self.seed = seed
+        self.swaps = 0 # accepted swaps in the last search
+        
+        
+    def solve(self, load, deadline=None, processes=None):
+        '''
+        Anytime interface, see SimulatedAnnealing.solve. The deadline is
+        checked after each round.
+            * type load: commons.Load
+            * param deadline: time (as returned by time.time()) when the
+              search has to stop [default None, no deadline]
+            * param processes: number of worker processes [default: one per
+              chain; 1 runs the chains in this process]
+            * rtype: commons.Result
+        '''
+        start = time.time()
+        baseline = Heuristic(self.N, self.nu, self.costs.c1, self.costs.c2,
+                             self.cores).heuristic(load)
+        init = (baseline.get_m(), baseline.get_d(), baseline.get_u(), baseline.get_cost())
+        states = [init] * self.chains # states[i] runs at self.temps[i]
+        best = init
+        evaluations = 0
+        self.swaps = 0
+        rng = random.Random(self.seed)
+        complete = True
+        
+        pool = None
+        if processes is None:
+            processes = self.chains
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+        try:
+            for r in xrange(self.rounds):
+                if deadline is not None and time.time() >= deadline:
+                    complete = False
+                    break
+                tasks = [(self.N, self.nu, self.costs.c1, self.costs.c2, self.cores, load.lam,
+                          load.mu, states[i], self.temps[i], self.sweep,
+                          hash((self.seed, i, r))) for i in xrange(self.chains)]
+                if pool is None:
+                    results = map(_tempering_chain, tasks)
+                else:
+                    results = pool.map(_tempering_chain, tasks)
+                for i, (state, chain_best, count) in enumerate(results):
+                    states[i] = state
+                    evaluations += count
+                    if chain_best[3] < best[3]:
+                        best = chain_best
+                # swap adjacent chains, alternating even and odd pairs
+                for i in xrange(r % 2, self.chains - 1, 2):
+                    delta = ((1.0 / self.temps[i] - 1.0 / self.temps[i + 1]) *
+                             (states[i][3] - states[i + 1][3]))
+                    if delta >= 0.0 or exp(delta) > rng.random():
+                        states[i], states[i + 1] = states[i + 1], states[i]
+                        self.swaps += 1
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        
+        sol = commons.Solution(best[3], commons.Reserves(best[0], best[1], best[2]))
+        return commons.Result(sol, baseline, evaluations, time.time() - start, complete)
+
+
+
+
+# Moves of the hill climbing, as (delta m, delta D, delta U)
+HILL_MOVES = ((-1, 0, 0), (1, 0, 0), (0, -1, 0), (0, 1, 0), (0, 0, -1), (0, 0, 1),
+              (0, 1, 1), (0, -1, -1))
+
+
+def _hill_climb(args):
+    '''
+    Runs a single climb of HillClimbing.multi_start (executed by the worker
+    processes)
+        * rtype: tuple (m, D, U, cost, evaluations, expired)
+    '''
+    N, nu, c1, c2, lam, mu, seed, deadline, constraint, cost_cache = args
+    # one object per process, to reuse the partial results of the evaluations
+    key = (N, nu, c1, c2, constraint, cost_cache)
+    hc = _hill_climbers.get(key)
+    if hc is None:
+        hc = HillClimbing(N, nu, c1, c2, cost_cache, constraint)
+        _hill_climbers[key] = hc
+    hc.evaluations = 0
+    sol = hc.hillClimbing(seed[0], seed[1], seed[2], commons.Load(lam, mu), deadline)
+    return (sol.get_m(), sol.get_d(), sol.get_u(), sol.get_cost(), hc.evaluations,
+            hc.expired)
+
+_hill_climbers = {}
+
+
 class HillClimbing:
     '''
-    Hill climbing search. This algorithm is likely to get stuck in a local
-    minima.
+    Steepest descent hill climbing. Each step moves to the best neighbour,
+    provided it is strictly better than the current configuration; the
+    configurations already evaluated are never evaluated again, so the
+    search cannot cycle. This algorithm is likely to get stuck in a local
+    minima, see multi_start.
     '''
 
-    def __init__(self, N, nu, c1, c2):
+    def __init__(self, N, nu, c1, c2, cost_cache=None, constraint=None):
         '''
         Constructor
+            * cost_cache: cache.CostCache (default cache.shared)
+            * constraint: LatencyConstraint; the configurations that do not
+              meet it have infinite cost [default None]
         '''
         self.N = N
         self.nu = nu
         self.costs = commons.Costs(c1, c2)
+        self.constraint = constraint
+        self.evaluator = None
+        self.cost_cache = cost_cache
+        if cost_cache is None:
+            self.cost_cache = cache.shared
+        self.evaluations = 0
+        self.steps = 0 # moves made by the last climb
+        self.expired = False # True if the last search stopped at the deadline
         
     def cost(self, res, load):
         '''
-        Evaluates the cost function for the given parameters.
+        Evaluates the cost function for the given parameters, reusing the
+        partial results of the previous evaluations with the same load.
         '''
-        return anor.AnnOperRes(self.N, self.nu, self.costs.c1, self.costs.c2).cost(res, load)
+        self.evaluations += 1
+        sol = self.cost_cache.cost(self.N, self.nu, self.costs, res, load, self.__incremental)
+        if self.constraint is not None and \
+                not self.constraint.satisfied(self.N, self.nu, res, load):
+            return commons.Solution(float('inf'), res)
+        return sol
     
-    def addToSet(self, s, val):
-        #if val not in s:
-        #   s.add(val)
-        #  return True
-        #return False
-        return True
+    def __incremental(self, res, load):
+        if self.evaluator is None or not self.evaluator.same_load(load):
+            self.evaluator = anor.IncrementalCost(self.N, self.nu, self.costs.c1, self.costs.c2, load)
+        return self.evaluator.cost(res)
     
     
+    def neighbors(self, m, D, U):
+        '''
+        Gets the valid neighbours of (m, D, U), see HILL_MOVES. Neighbours
+        with D = U < N - m - 1 are outside the domain of the cost function
+        and are discarded.
+            * rtype: list of tuples (m, D, U)
+        '''
+        result = []
+        for dm, dD, dU in HILL_MOVES:
+            m1, D1, U1 = m + dm, D + dD, U + dU
+            if m1 < 0 or m1 >= self.N or D1 < 0 or U1 < D1:
+                continue
+            if D1 == U1 and U1 < self.N - m1 - 1:
+                continue
+            result.append((m1, D1, U1))
+        return result
+    
         
-    def hillClimbing(self, initialM, initialD, initialU, load):
+    def hillClimbing(self, initialM, initialD, initialU, load, deadline=None):
         '''
         Hill climbing method
+            * param deadline: if not None, the search stops at this time
+              (as returned by time.time()) [default None]
+            * rtype: commons.Solution, the local optimum
         '''
+        current = (initialM, initialD, initialU)
+        best = self.cost(commons.Reserves(*current), load)
+        visited = set([current])
         
-        best_configuration = commons.Reserves(initialM, initialD, initialU) # Reserves
-        best_cost = self.cost(best_configuration, load) # type EstimatedCost
-        
-        count = 0
-        optimal = False
-        cache = set()
-        while (optimal == False):
-            optimal = True
+        self.steps = 0
+        self.expired = False
+        while True:
+            if deadline is not None and time.time() >= deadline:
+                self.expired = True
+                break
             
-            neighbors = []
-            for i in xrange(0, 8):
-                tmp = best_configuration
-                conf = None
-                
-                evaluate = False
-                if i == 0: # m-1
-                    if tmp.m > 0:
-                        conf = commons.Reserves(tmp.m-1, tmp.D, tmp.U)
-                        evaluate = self.addToSet(cache, conf)
-                elif i == 1: # m+1
-                    if tmp.m < self.N:
-                        conf =  commons.Reserves(tmp.m+1, tmp.D, tmp.U)
-                        evaluate = self.addToSet(cache, conf)
-                elif i == 2: # D-1
-                    if tmp.D > 0:
-                        conf =  commons.Reserves(tmp.m, tmp.D-1, tmp.U)
-                        evaluate = self.addToSet(cache, conf)
-                elif i == 3: # D+1
-                    if tmp.D < tmp.U:
-                        conf =  commons.Reserves(tmp.m, tmp.D+1, tmp.U)
-                        evaluate = self.addToSet(cache, conf)
-                elif i == 4: # U-1
-                    if tmp.U > tmp.D:
-                        conf =  commons.Reserves(tmp.m, tmp.D, tmp.U-1)
-                        evaluate = self.addToSet(cache, conf)
-                elif i == 5: # U+1
-                    conf =  commons.Reserves(tmp.m, tmp.D, tmp.U+1)
-                    evaluate = self.addToSet(cache, conf)
-                elif i == 6: # m, D+1, U+1
-                    conf =  commons.Reserves(tmp.m, tmp.D+1, tmp.U+1)
-                    evaluate = self.addToSet(cache, conf)
-                elif i == 7: # m, D-1, U-1
-                    if tmp.D > 0: # U >= D
-                        conf =  commons.Reserves(tmp.m, tmp.D-1, tmp.U-1)
-                        evaluate = self.addToSet(cache, conf)
-                else:
-                    raise BaseException("Unreachable state")
-        
-                del tmp
-                if evaluate == True:                        
-                        count += 1
-                        cost = self.cost(conf, load)
-                        neighbors.append(cost)
-                        print cost.__str__()
-                    
-            for i in xrange(0, len(neighbors)):
-                if neighbors[i] is not None:
-                    tmp1 = decimal.Decimal(neighbors[i].get_cost())
-                    best = decimal.Decimal(best_cost.get_cost())
-                    if tmp1.compare(best) <= 0.0:
-                        optimal = False
-                        best_cost = neighbors[i]
-                        best_configuration = neighbors[i].reserves
+            candidate = None
+            candidate_sol = None
+            for conf in self.neighbors(*current):
+                if conf in visited:
+                    continue
+                visited.add(conf)
+                sol = self.cost(commons.Reserves(*conf), load)
+                if candidate_sol is None or sol.get_cost() < candidate_sol.get_cost():
+                    candidate = conf
+                    candidate_sol = sol
             
-        print("Counter %d\n" % count)
-        return best_cost
+            if candidate_sol is None or candidate_sol.get_cost() >= best.get_cost():
+                break # local optimum
+            current = candidate
+            best = candidate_sol
+            self.steps += 1
+            
+        return best
+    
+    
+    def seeds(self, load, starts, cores=1):
+        '''
+        Gets the starting points of multi_start: the heuristic solution and
+        the configurations obtained by moving its number of reserves up and
+        down, with the thresholds chosen by the heuristic.
+            * param starts: number of starting points
+            * param cores: step between the number of reserves of two seeds
+            * rtype: list of tuples (m, D, U)
+        '''
+        heuristic = Heuristic(self.N, self.nu, self.costs.c1, self.costs.c2, cores,
+                              self.cost_cache, self.constraint)
+        baseline = heuristic.heuristic(load)
+        result = [(baseline.get_m(), baseline.get_d(), baseline.get_u())]
+        k = 1
+        while len(result) < starts and k < self.N:
+            for m in (baseline.get_m() - k * cores, baseline.get_m() + k * cores):
+                if 0 <= m < self.N and len(result) < starts:
+                    D, U = heuristic.compute_queue_thresholds(load, m)
+                    result.append((m, D, U))
+            k += 1
+        return result
+    
+    
+    def multi_start(self, load, starts=None, cores=1, deadline=None, processes=None):
+        '''
+        Runs several climbs, from the starting points given by seeds, in
+        parallel, and returns the best local optimum.
+            * type load: commons.Load
+            * param starts: number of climbs [default: number of cores]
+            * param cores: step between the number of reserves of two seeds
+            * param deadline: if not None, the climbs stop at this time
+              (as returned by time.time()) [default None]
+            * param processes: number of worker processes [default: one per
+              climb; 1 runs the climbs in this process]
+            * rtype: commons.Solution
+        '''
+        if starts is None:
+            starts = multiprocessing.cpu_count()
+        if starts < 1:
+            raise ValueError('starts must be positive: %d' % starts)
+        seeds = self.seeds(load, starts, cores)
+        if processes is None:
+            processes = len(seeds)
+        # the worker processes use their own cache (the shared one)
+        cost_cache = self.cost_cache if processes <= 1 else None
+        tasks = [(self.N, self.nu, self.costs.c1, self.costs.c2, load.lam, load.mu, seed,
+                  deadline, self.constraint, cost_cache) for seed in seeds]
+        if processes > 1:
+            pool = multiprocessing.Pool(min(processes, len(tasks)))
+            try:
+                results = pool.map(_hill_climb, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(_hill_climb, tasks)
+        
+        # ties go to the first seed, i.e., the closest to the heuristic
+        best = min(results, key=lambda r: r[3])
+        self.evaluations += sum(r[4] for r in results)
+        self.expired = any(r[5] for r in results)
+        return commons.Solution(best[3], commons.Reserves(best[0], best[1], best[2]))
+    
+    
+    def solve(self, load, deadline=None, initial=None, starts=1, processes=None):
+        '''
+        Anytime interface, see SimulatedAnnealing.solve
+            * type load: commons.Load
+            * param deadline: time (as returned by time.time()) when the
+              search has to stop [default None, no deadline]
+            * type initial: commons.Reserves
+            * param initial: starting point [default: the heuristic solution]
+            * param starts: if greater than 1 (and initial is None) runs
+              multi_start with this number of climbs [default 1]
+            * param processes: see multi_start
+            * rtype: commons.Result
+        '''
+        start = time.time()
+        self.evaluations = 0
+        baseline = Heuristic(self.N, self.nu, self.costs.c1, self.costs.c2, 1,
+                             self.cost_cache, self.constraint).heuristic(load)
+        if initial is None and starts > 1:
+            sol = self.multi_start(load, starts, 1, deadline, processes)
+        else:
+            if initial is None:
+                initial = baseline.reserves
+            sol = self.hillClimbing(initial.m, initial.D, initial.U, load, deadline)
+        return commons.Result(sol, baseline, self.evaluations, time.time() - start,
+                              not self.expired)
+
+
+# Default number of tiers used by TieredSearch
+TIERS = 2
+# Moves of the thresholds of a tier, as (delta D, delta U), times the step
+TIER_MOVES = ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (1, 1))
+
+
+class TieredSearch:
+    '''
+    Optimizes the reserves split into tiers (commons.Tiers), each one with
+    its own thresholds, see anor.MultiTierRes. The search starts from the
+    single block found by HillClimbing, split into the given number of
+    tiers, and is a compass search: each step moves to the best neighbour,
+    where the thresholds change by +/- step, cores move between tiers, and
+    tiers are added, split or removed; the step halves when no neighbour is
+    better. The single block is returned if it turns out to be better.
+    '''
+
+    def __init__(self, N, nu, c1, c2, tiers=TIERS, cores=1):
+        '''
+        Constructor
+            * tiers: max number of tiers [default TIERS]
+            * cores: number of cores per server; the size of the tiers is
+              a multiple of it [default 1]
+        '''
+        if tiers < 1:
+            raise ValueError('At least one tier is required: %d' % tiers)
+        self.N = N
+        self.nu = nu
+        self.costs = commons.Costs(c1, c2)
+        self.tiers = tiers
+        self.cores = cores
+        self.model = anor.MultiTierRes(N, nu, c1, c2)
+        self.evaluations = 0
+        self.steps = 0
+        self.expired = False
+        self.__memo = {} # tiers -> commons.Solution, for self.__load
+        self.__load = None # (lam, mu)
         
-        
\ No newline at end of file
+        
+    def cost(self, tiers, load):
+        '''
+        Evaluates the cost of the given tiers
+            * type tiers: commons.Tiers
+            * rtype: commons.Solution
+        '''
+        if self.__load != (load.lam, load.mu):
+            self.__memo.clear()
+            self.__load = (load.lam, load.mu)
+        sol = self.__memo.get(tiers)
+        if sol is None:
+            self.evaluations += 1
+            sol = self.model.cost(tiers, load)
+            self.__memo[tiers] = sol
+        return sol
+    
+    
+    def neighbors(self, tiers, step):
+        '''
+        Gets the valid neighbours of the given tiers
+            * type tiers: commons.Tiers
+            * param step: the change of the thresholds
+            * rtype: list of commons.Tiers
+        '''
+        c = self.cores
+        current = list(tiers)
+        candidates = []
+        for i, t in enumerate(current):
+            others = current[:i] + current[i + 1:]
+            for dD, dU in TIER_MOVES:
+                candidates.append(others + [(t.m, t.D + dD * step, t.U + dU * step)])
+            candidates.append(others + [(t.m - c, t.D, t.U)])
+            candidates.append(others + [(t.m + c, t.D, t.U)])
+            for j, o in enumerate(current):
+                if j != i: # c cores from tier i to tier j
+                    rest = [x for k, x in enumerate(current) if k not in (i, j)]
+                    candidates.append(rest + [(t.m - c, t.D, t.U), (o.m + c, o.D, o.U)])
+            if len(current) < self.tiers:
+                # split, the new tier powers up later
+                candidates.append(others + [(t.m - c, t.D, t.U), (c, t.D, t.U + step)])
+        if len(current) < self.tiers:
+            last = current[-1] if len(current) > 0 else commons.Reserves(0, self.N - c - 1, self.N)
+            candidates.append(current + [(c, last.D, last.U + step)])
+        
+        result = set()
+        for cand in candidates:
+            cand = [x for x in cand if x[0] != 0]
+            if any(m < 0 or D < 0 or U < D for m, D, U in cand):
+                continue
+            if sum(x[0] for x in cand) >= self.N:
+                continue
+            result.add(commons.Tiers([commons.Reserves(*x) for x in cand]))
+        result.discard(tiers)
+        return sorted(result)
+    
+    
+    def search(self, tiers, load, deadline=None):
+        '''
+        Compass search from the given tiers
+            * type tiers: commons.Tiers
+            * param deadline: if not None, the search stops at this time
+              (as returned by time.time()) [default None]
+            * rtype: commons.Solution
+        '''
+        best = self.cost(tiers, load)
+        step = max(1, max([t.U for t in tiers] + [self.N]) / 4)
+        self.steps = 0
+        self.expired = False
+        while step >= 1:
+            candidate = None
+            for cand in self.neighbors(best.reserves, step):
+                if deadline is not None and time.time() >= deadline:
+                    self.expired = True
+                    return best
+                sol = self.cost(cand, load)
+                if candidate is None or sol.cost < candidate.cost:
+                    candidate = sol
+            if candidate is not None and candidate.cost < best.cost:
+                best = candidate
+                self.steps += 1
+            else:
+                step /= 2
+        return best
+    
+    
+    def solve(self, load, deadline=None, initial=None):
+        '''
+        Anytime interface, see SimulatedAnnealing.solve; the baseline of the
+        result is the single block of reserves found by HillClimbing
+            * type load: commons.Load
+            * param deadline: time (as returned by time.time()) when the
+              search has to stop [default None, no deadline]
+            * type initial: commons.Tiers
+            * param initial: starting point [default: the single block,
+              split into tiers]
+            * rtype: commons.Result
+        '''
+        start = time.time()
+        self.evaluations = 0
+        self.__memo.clear()
+        block = HillClimbing(self.N, self.nu, self.costs.c1, self.costs.c2).solve(
+            load, deadline).solution.reserves
+        single = self.cost(commons.Tiers.split(block, 1, self.cores), load)
+        if initial is None:
+            initial = commons.Tiers.split(block, self.tiers, self.cores)
+        sol = self.search(initial, load, deadline)
+        if single.cost < sol.cost:
+            sol = single
+        return commons.Result(sol, single, self.evaluations, time.time() - start,
+                              not self.expired)
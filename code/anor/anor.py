@@ -19,10 +19,97 @@ Created on Dec 19, 2011
 @author: michele
 '''
 
-from math import sqrt, isinf
+from math import sqrt, ceil, exp, log, isinf, isnan
 import numpy
 import commons
 
+
+# Max number of matrix cells (configurations x (U - D)) processed at once by
+# AnnOperRes.cost_batch. Bounds the memory used by the vectorized evaluation.
+BATCH_MAX_CELLS = 1 << 20
+
+# Default truncation of AnnOperRes.distribution: the probability of the
+# states left out
+DISTRIBUTION_EPS = 1e-12
+
+
+class Workspace():
+    '''
+    Buffers used by AnnOperRes.cost. They are plain lists, which are faster
+    than NumPy arrays when accessed one element at a time, and are reused
+    across calls: they only grow (geometrically) when a larger U - D is
+    evaluated.
+    '''
+
+
+    def __init__(self, size=64):
+        self.size = 0
+        self.r = [] # consts for p0j
+        self.p1j = [] # p1j for j=D+1,...,U
+        self.bj = [] # bj=lam+mj+nu
+        self.aj = [] # aj computed recurrently
+        self.p1 = [] # backwards partial sums of p1j
+        self.reserve(size)
+
+
+    def reserve(self, size):
+        '''
+        Makes sure that the buffers hold at least size elements
+        '''
+        if size <= self.size:
+            return
+        new_size = max(size, 2 * self.size)
+        for buf in (self.r, self.p1j, self.bj, self.aj, self.p1):
+            buf.extend([0.0] * (new_size - self.size))
+        self.size = new_size
+
+
+def _lse(terms):
+    '''
+    log(sum(exp(terms))), computed without overflow
+        * param terms: sequence of logarithms (-inf stands for 0)
+    '''
+    terms = numpy.asarray(terms, dtype=numpy.float64)
+    if len(terms) == 0:
+        return -numpy.inf
+    top = terms.max()
+    if numpy.isinf(top):
+        return top
+    return top + numpy.log(numpy.exp(terms - top).sum())
+
+
+def _log_poisson_tail(x, kmax):
+    '''
+    log P(Poisson(x) >= k), k=0,...,kmax
+        * rtype: numpy array
+    '''
+    # the terms above top are negligible
+    top = int(max(kmax, x + 12.0 * sqrt(x) + 30.0)) + 30
+    i = numpy.arange(0, top + 1)
+    lfact = numpy.concatenate(([0.0], numpy.cumsum(numpy.log(i[1:]))))
+    if x > 0.0:
+        lpmf = -x + i * numpy.log(x) - lfact
+    else:
+        lpmf = numpy.where(i == 0, 0.0, -numpy.inf)
+    return numpy.logaddexp.accumulate(lpmf[::-1])[::-1][:kmax + 1]
+
+
+def _log_linear(lalpha, lbeta, lx0):
+    '''
+    Solves, in the log domain, the linear recursion with positive
+    coefficients x(j) = alpha(j) * x(j - 1) + beta(j), j=0,1,..., i.e.,
+    x(j) = A(j) * (x(-1) + sum_i beta(i) / A(i)) with A(j) = prod alpha
+        * param lalpha: log(alpha(j)), numpy array
+        * param lbeta: log(beta(j)), numpy array
+        * param lx0: log(x(-1))
+        * rtype: numpy array with log(x(j))
+    '''
+    lA = numpy.cumsum(lalpha)
+    with numpy.errstate(invalid='ignore'):
+        acc = numpy.logaddexp.accumulate(numpy.concatenate(([lx0], lbeta - lA)))
+    return lA + acc[1:]
+
+
 class AnnOperRes():
     '''
     Annal Operation Research paper: evaluates the cost function for a particular
@@ -34,9 +121,10 @@ class AnnOperRes():
         self.N = N
         self.nu = nu
         self.costs = commons.Costs(c1, c2)
+        self.workspace = Workspace()
         
     
-	def zeros(self, size):
+    def zeros(self, size):
         '''
         Creates an array with the specified size
         '''
@@ -96,19 +184,17 @@ class AnnOperRes():
         if isinf(h2):
             raise ArithmeticError("h2 is infinity!")
         
+        # buffers, only the first U - D elements are used
+        ws = self.workspace
+        ws.reserve(U - D)
+        
         #line 29
         #array of consts for p0j, j=s+1,...,K
-        r = self.zeros(U - D)
+        r = ws.r
         r[0] = 1 + mu * min(U, n) / lam
         
         for j in xrange(1, res.U - res.D):   #compute r(j)
-            try:
-                r[j] = 1 + r[j - 1] * mu * min(U + 1 - (j + 1), n) / lam
-            except FloatingPointError, e:
-                #print "balbla {0}".format(e)
-                print r[j-1], mu,  min(U + 1 - (j + 1), n), lam
-                print 'm %d, D %d U %d' % (m, D, U)
-                raise (e)
+            r[j] = 1 + r[j - 1] * mu * min(U + 1 - (j + 1), n) / lam
             
         p0U = p / r[U - D - 1] # p0U
         p0 = p0 + p0U # update p0
@@ -123,13 +209,13 @@ class AnnOperRes():
 
         # line 42
         norm = p0 # normalization constant; sum of all probs
-        p1j = self.zeros(U - D) # p1j for j=D+1,...,U
-        bj = self.zeros(U - D) # bj=lam+mj+nu
+        p1j = ws.p1j # p1j for j=D+1,...,U
+        bj = ws.bj # bj=lam+mj+nu
         for j in xrange(0, U - D):
             bj[j] = lam + nu + min(D + (j + 1), n) * mu
         
         a = 0.0
-        aj = self.zeros(U - D - 1) # aj computed recurrently
+        aj = ws.aj # aj computed recurrently
         if (res.D < res.U - 1):            # line 48
             aj[0] = min(D + 2, n) * mu / bj[0] # aD+1
             for j in xrange(1, U - D - 1): #aj for j=D+2,...,U-1
@@ -150,7 +236,7 @@ class AnnOperRes():
             norm = norm + p1j[j] # update norm
             L = L + (D + (j + 1)) * p1j[j] # update L
         # backwards partial sums p1j for j=D+1,...,U
-        p1 = self.zeros(U - D);
+        p1 = ws.p1
         p1[U - D - 1] = p1j[U - D - 1] # last element
 
         for j in xrange(U - D - 2, -1, -1): # other partial sums
@@ -188,15 +274,236 @@ class AnnOperRes():
         norm = norm + g1 + g2 # UPDATE NORMALIZATION CONSTANT
         L = L + g1p + g2p # update mean
 
-        try:
-            p0 = p0 / norm # normalize p0
-        except FloatingPointError, e:
-            print p0, norm, res.m, res.D, res.U
-            raise e
+        p0 = p0 / norm # normalize p0
         L = L / norm # normalize mean
         c = L * self.costs.c1 + (N - m * p0) * self.costs.c2 # average cost
+        if isinf(c) or isnan(c): # overflow, see cost_log
+            return self.cost_log(res, load)
         return commons.Solution(c, res)
-    
+
+
+    def cost_batch(self, load, m_array, D_array, U_array):
+        '''
+        Computes the cost of many configurations at once. The recursions
+        of cost() are run column by column over all the configurations,
+        so that each step is a single NumPy operation.
+            * type load: commons.Load
+            * param m_array: number of reserves, one entry per configuration
+            * param D_array: lower thresholds
+            * param U_array: upper thresholds
+            * rtype: tuple (numpy array with the costs, index of the minimum)
+        '''
+        m = numpy.asarray(m_array, dtype=numpy.int64).ravel()
+        D = numpy.asarray(D_array, dtype=numpy.int64).ravel()
+        U = numpy.asarray(U_array, dtype=numpy.int64).ravel()
+        if not (len(m) == len(D) == len(U)):
+            raise ValueError('m, D and U must have the same length')
+        c = self.__cost_rows([load], numpy.zeros(len(m), dtype=numpy.int64), m, D, U)
+        return c, int(numpy.argmin(c))
+
+
+    def cost_curves(self, reserves, loads):
+        '''
+        Computes the cost of each configuration under each load (e.g., the
+        arrival rates forecast for the next hours), as a single batch, see
+        cost_batch
+            * type reserves: list of commons.Reserves
+            * type loads: list of commons.Load
+            * rtype: numpy array, with one row per configuration and one
+              column per load
+        '''
+        R = len(reserves)
+        T = len(loads)
+        if T == 0:
+            raise ValueError('no loads to evaluate')
+        m = numpy.repeat(numpy.array([res.m for res in reserves], dtype=numpy.int64), T)
+        D = numpy.repeat(numpy.array([res.D for res in reserves], dtype=numpy.int64), T)
+        U = numpy.repeat(numpy.array([res.U for res in reserves], dtype=numpy.int64), T)
+        which = numpy.tile(numpy.arange(T), R)
+        return self.__cost_rows(loads, which, m, D, U).reshape(R, T)
+
+
+    def expected_cost(self, reserves, loads, weights=None):
+        '''
+        Computes the expected cost of each configuration over a set of
+        loads, e.g., the quantiles of a forecast
+            * type reserves: list of commons.Reserves
+            * type loads: list of commons.Load
+            * param weights: probability of each load [default: uniform]
+            * rtype: tuple (numpy array with the expected costs, index of
+              the minimum)
+        '''
+        curves = self.cost_curves(reserves, loads)
+        if weights is None:
+            costs = curves.mean(axis=1)
+        else:
+            weights = numpy.asarray(weights, dtype=numpy.float64)
+            if len(weights) != len(loads):
+                raise ValueError('one weight per load is required')
+            costs = curves.dot(weights / weights.sum())
+        return costs, int(numpy.argmin(costs))
+
+
+    def __cost_rows(self, loads, which, m, D, U):
+        '''
+        Computes the costs of the configurations (m[i], D[i], U[i]) under
+        the loads loads[which[i]]
+        '''
+        if len(m) == 0:
+            raise ValueError('no configurations to evaluate')
+        if (m < 0).any() or (D < 0).any() or (U < D).any():
+            raise ValueError('invalid configuration: need m >= 0 and 0 <= D <= U')
+        for load in loads:
+            if self.N == load.get_load():
+                raise ArithmeticError("N should be larger than the load!")
+        lam = numpy.array([load.lam for load in loads], dtype=numpy.float64)[which]
+        mu = numpy.array([load.mu for load in loads], dtype=numpy.float64)[which]
+
+        c = numpy.empty(len(m), dtype=numpy.float64)
+
+        # special cases: M/M/N queue and D == U
+        zero = (m == 0)
+        if zero.any():
+            c0 = numpy.array([self.cost0(load).get_cost() for load in loads])
+            c[zero] = c0[which[zero]]
+        single = numpy.flatnonzero(~zero & (D == U))
+        for i in single:
+            c[i] = self.cost1(int(m[i]), int(U[i]), loads[which[i]]).get_cost()
+
+        # general case; sorting by U - D keeps the padding of each chunk small
+        general = numpy.flatnonzero(~zero & (D < U))
+        if len(general) > 0:
+            general = general[numpy.argsort(U[general] - D[general], kind='mergesort')]
+            size = max(1, BATCH_MAX_CELLS // int(U[general[-1]] - D[general[-1]]))
+            for start in xrange(0, len(general), size):
+                idx = general[start:start + size]
+                with numpy.errstate(all='ignore'):
+                    c[idx] = self.__cost_general_batch(lam[idx], mu[idx], m[idx], D[idx],
+                                                       U[idx])
+            # overflow, see cost_log
+            for i in general[~numpy.isfinite(c[general])]:
+                c[i] = self.cost_log(commons.Reserves(int(m[i]), int(D[i]), int(U[i])),
+                                     loads[which[i]]).get_cost()
+        return c
+
+
+    def __cost_general_batch(self, lam, mu, m, D, U):
+        '''
+        Vectorized version of cost() for m > 0 and D < U; lam and mu are
+        arrays, with one entry per configuration
+        '''
+        N = self.N
+        nu = self.nu
+        rho = lam / mu
+        n = N - m
+        K = U - D
+        kmax = int(K.max())
+        rows = numpy.arange(len(m))
+        C = len(m)
+
+        # line 18
+        p = numpy.ones(C)
+        p0 = numpy.ones(C)
+        L = numpy.zeros(C)
+        for j in xrange(1, int(D.max()) + 1):
+            act = j <= D
+            p = numpy.where(act, p * rho / numpy.minimum(j, n), p)
+            p0 += numpy.where(act, p, 0.0)
+            L += numpy.where(act, j * p, 0.0)
+
+        b = lam + n * mu + nu
+        z1 = (b - numpy.sqrt(b * b - 4 * n * lam * mu)) / (2 * lam)
+        z2 = (b + numpy.sqrt(b * b - 4 * n * lam * mu)) / (2 * lam)
+        h1 = 1 / (z2 - 1)
+        h2 = 1 / (N * mu - lam)
+        m1 = 1 / mu
+        if numpy.isinf(h2).any():
+            raise ArithmeticError("h2 is infinity!")
+
+        # line 29, r(j) is only needed through its sums and its last value
+        r = 1 + mu * numpy.minimum(U, n) / lam
+        r_last = r.copy()
+        r_sum = numpy.where(K > 1, r, 0.0)
+        r_wsum = numpy.where(K > 1, (U - 1) * r, 0.0)
+        for j in xrange(1, kmax):
+            act = j < K
+            r = numpy.where(act, 1 + r * mu * numpy.minimum(U - j, n) / lam, r)
+            r_last = numpy.where(j == K - 1, r, r_last)
+            inner = j < K - 1
+            r_sum += numpy.where(inner, r, 0.0)
+            r_wsum += numpy.where(inner, (U - (j + 1)) * r, 0.0)
+
+        p0U = p / r_last
+        p0 += p0U + r_sum * p0U
+        L += U * p0U + r_wsum * p0U
+
+        # line 42
+        norm = p0.copy()
+        aj = numpy.zeros((C, max(kmax - 1, 1)))
+        if kmax > 1:
+            bj = lam + nu + numpy.minimum(D + 1, n) * mu
+            aj[:, 0] = numpy.where(K > 1, numpy.minimum(D + 2, n) * mu / bj, 0.0)
+            for j in xrange(1, kmax - 1):
+                bj = lam + nu + numpy.minimum(D + (j + 1), n) * mu
+                aj[:, j] = numpy.where(j < K - 1, numpy.minimum(D + (j + 1) + 1, n) * mu
+                                       / (bj - lam * aj[:, j - 1]), 0.0)
+        a = numpy.where(K > 1, aj[rows, numpy.maximum(K - 2, 0)], 0.0)
+
+        # line 58, compute p1U
+        bU = lam + nu + numpy.minimum(U, n) * mu
+        p1U = p0U * lam * z1 / (bU - lam * a - lam * z1)
+        norm += p1U
+        L += U * p1U
+
+        # line 61, compute p1j backwards together with the partial sums
+        p1 = numpy.zeros((C, kmax))
+        p1[rows, K - 1] = p1U
+        p1j = p1U.copy()
+        psum = p1U.copy()
+        for j in xrange(kmax - 2, -1, -1):
+            act = j < K - 1
+            p1j = numpy.where(act, aj[:, j] * p1j, p1j)
+            tmp = numpy.where(act, p1j, 0.0)
+            norm += tmp
+            L += (D + (j + 1)) * tmp
+            psum += tmp
+            p1[:, j] = numpy.where(act, psum, p1[:, j])
+
+        # line 71
+        g1 = (p0U + p1U) * h1
+        g1p = g1 * (U + 1 + h1)
+        p2 = numpy.zeros(C)
+        for j in xrange(0, kmax): # p2j for j=D+1,...,U
+            act = j < K
+            tmp = ((p1[:, j] + g1) * nu + p2 * lam) * m1 / numpy.minimum(D + j + 1, N)
+            p2 = numpy.where(act, tmp, p2)
+            norm += numpy.where(act, p2, 0.0)
+            L += numpy.where(act, (D + j + 1) * p2, 0.0)
+
+        # p2j for j=U+1,...,N-1 (case 2 only)
+        zj = numpy.ones(C)
+        for t in xrange(0, max(0, N - 1 - int(U.min()))):
+            j = U + 1 + t
+            act = j < N
+            p2 = numpy.where(act, (g1 * nu * zj + p2 * lam) * m1 / j, p2)
+            norm += numpy.where(act, p2, 0.0)
+            L += numpy.where(act, j * p2, 0.0)
+            zj = numpy.where(j < N - 1, zj / z2, zj)
+
+        case2 = U + 1 < N
+        g2 = numpy.where(case2, (lam * p2 + nu * g1 * zj * h1) * h2,
+                         (lam * p2 + nu * g1 * z2 * h1) * h2)
+        g2p = numpy.where(case2,
+                          (lam * (g2 + N * p2) + nu * g1 * zj * h1 * (N + h1)) * h2,
+                          (lam * (g2 + (U + 1) * p2) + nu * g1 * z2 * h1 * (U + 1 + h1)) * h2)
+
+        # line 97
+        norm += g1 + g2
+        L += g1p + g2p
+        p0 = p0 / norm
+        L = L / norm
+        return L * self.costs.c1 + (N - m * p0) * self.costs.c2
+
 
     def cost0(self, load):
         '''
@@ -219,6 +526,8 @@ class AnnOperRes():
         L = L / norm; # normalize mean
         L = L + g1 * (self.N + 1 + h1) # average no. of jobs present
         c = L * self.costs.c1 + self.N * self.costs.c2 # average cost
+        if isinf(c) or isnan(c): # overflow, see cost_log
+            return self.cost0_log(load)
         return commons.Solution(c)
         
         
@@ -284,8 +593,804 @@ class AnnOperRes():
         g2 = g2 / norm # normalize g2
         L = L / norm # normalize mean
         c = L * self.costs.c1 + (self.N - m * (1 - g1 - g2)) * self.costs.c2 # average cost
+        if isinf(c) or isnan(c): # overflow, see cost_log
+            return self.cost1_log(m, K, load)
         return commons.Solution(c, commons.Reserves(m, K, K))
 
+
+    def cost_log(self, res, load):
+        '''
+        Same as cost(), but the recursions are solved in the log domain, so
+        that the probabilities never overflow or underflow (e.g., for N in
+        the thousands, or for very large U). Slower than cost(), which uses
+        it when its own result is not finite.
+            * type res: commons.Reserves
+            * type load: commons.Load
+            * rtype: commons.Solution
+        '''
+        m = res.m
+        D = res.D
+        U = res.U
+        if m == 0:
+            return self.cost0_log(load)
+        if D == U:
+            return self.cost1_log(m, U, load)
+        lam = load.lam
+        nu = self.nu
+        N = self.N
+        K = U - D
+        log = numpy.log
+        lp, lr, lp0U, lp1, lp2, lg1, z2, h1, h2 = self.__log_head(res, load)
+        norm = [] # logs of the terms of the normalization constant
+        mean = [] # logs of the terms of L
+
+        # p0j, j=0,...,D
+        norm.append(_lse(lp))
+        mean.append(_lse(log(numpy.arange(1, D + 1)) + lp[1:]))
+
+        # p0j, j=D+1,...,U
+        t = numpy.arange(0, K)
+        norm.append(lp0U)
+        mean.append(log(U) + lp0U)
+        norm.append(_lse(lr[:K - 1]) + lp0U)
+        mean.append(_lse(log(U - (t[:K - 1] + 1)) + lr[:K - 1]) + lp0U)
+
+        # p1j and p2j, j=D+1,...,U
+        levels = D + 1 + t
+        norm.append(_lse(lp1))
+        mean.append(_lse(log(levels) + lp1))
+        lg1p = lg1 + log(U + 1 + h1)
+        norm.append(_lse(lp2))
+        mean.append(_lse(log(levels) + lp2))
+        lp2 = lp2[K - 1]
+
+        # p2j, j=U+1,...,N-1
+        if U + 1 < N:
+            levels = numpy.arange(U + 1, N)
+            lzj = -log(z2) * numpy.arange(0, N - U - 1)
+            tail = self.__log_tail(load, levels, lg1 + lzj, lp2)
+            norm.append(_lse(tail))
+            mean.append(_lse(log(levels) + tail))
+            lp2 = tail[-1]
+            lzj = lzj[-1]
+            last = N
+        else:
+            lzj = log(z2)
+            last = U + 1
+        lg2 = log(h2) + numpy.logaddexp(log(lam) + lp2, log(nu) + lg1 + lzj + log(h1))
+        lg2p = log(h2) + numpy.logaddexp(log(lam) + numpy.logaddexp(lg2, log(last) + lp2),
+                                         log(nu) + lg1 + lzj + log(h1) + log(last + h1))
+        norm.extend([lg1, lg2])
+        mean.extend([lg1p, lg2p])
+
+        lnorm = _lse(norm)
+        p0 = numpy.exp(_lse(norm[:3]) - lnorm) # p0j, j=0,...,U
+        L = numpy.exp(_lse(mean) - lnorm)
+        c = L * self.costs.c1 + (N - m * p0) * self.costs.c2
+        return commons.Solution(float(c), res)
+
+
+    def __log_head(self, res, load):
+        '''
+        Log domain recursions of cost() for m > 0 and D < U, up to level U
+            * rtype: tuple (log p0j for j=0,...,D, log r(t) for t=0,...,U-D-1,
+              log p0U, log p1j and log p2j for j=D+1,...,U, log g1, z2, h1, h2)
+        '''
+        m = res.m
+        D = res.D
+        U = res.U
+        lam = load.lam
+        mu = load.mu
+        nu = self.nu
+        N = self.N
+        rho = load.get_load()
+        if N <= rho:
+            raise ArithmeticError("N should be larger than the load!")
+        n = N - m
+        K = U - D
+        log = numpy.log
+
+        b = lam + n * mu + nu
+        z1 = (b - sqrt(b * b - 4 * n * lam * mu)) / (2 * lam)
+        z2 = (b + sqrt(b * b - 4 * n * lam * mu)) / (2 * lam)
+        h1 = 1 / (z2 - 1)
+        h2 = 1 / (N * mu - lam)
+
+        # p0j, j=0,...,D
+        j = numpy.arange(1, D + 1)
+        lp = numpy.concatenate(([0.0], numpy.cumsum(log(rho) - log(numpy.minimum(j, n)))))
+
+        # p0j, j=D+1,...,U; r(t) = 1 + r(t - 1) * mu * min(U - t, n) / lam
+        t = numpy.arange(0, K)
+        lr = _log_linear(log(mu * numpy.minimum(U - t, n) / lam), numpy.zeros(K), 0.0)
+        lp0U = lp[D] - lr[K - 1]
+
+        # aj, bounded, no need for logs
+        aj = [0.0] * max(K - 1, 0)
+        for i in xrange(0, K - 1):
+            bj = lam + nu + min(D + i + 1, n) * mu
+            if i == 0:
+                aj[i] = min(D + 2, n) * mu / bj
+            else:
+                aj[i] = min(D + i + 2, n) * mu / (bj - lam * aj[i - 1])
+        a = aj[K - 2] if K > 1 else 0.0
+
+        # p1j, j=U,...,D+1 (index j - D - 1), and their partial sums
+        lp1U = lp0U + log(lam * z1 / (lam + nu + min(U, n) * mu - lam * a - lam * z1))
+        lp1 = numpy.empty(K)
+        lp1[K - 1] = lp1U
+        if K > 1:
+            lp1[:K - 1] = lp1U + numpy.cumsum(log(aj)[::-1])[::-1]
+        lpsum = numpy.logaddexp.accumulate(lp1[::-1])[::-1]
+
+        # p2j, j=D+1,...,U
+        lg1 = numpy.logaddexp(lp0U, lp1U) + log(h1)
+        lden = log(mu * numpy.minimum(D + 1 + t, N))
+        lp2 = _log_linear(log(lam) - lden, log(nu) + numpy.logaddexp(lpsum, lg1) - lden,
+                          -numpy.inf)
+        return lp, lr, lp0U, lp1, lp2, lg1, z2, h1, h2
+
+
+    def __log_tail(self, load, levels, lp1s, lx0):
+        '''
+        Log domain recursion of the p2j above the upper threshold:
+        min(j, N) * mu * p2j = lam * p2j-1 + nu * sum_k>=j p1k
+            * param levels: the values of j, numpy array
+            * param lp1s: log sum_k>=j p1k, numpy array
+            * param lx0: log p2j for the level before levels[0]
+            * rtype: numpy array with log p2j
+        '''
+        log = numpy.log
+        lden = log(load.mu * numpy.minimum(levels, self.N))
+        return _log_linear(log(load.lam) - lden, log(self.nu) + lp1s - lden, lx0)
+
+
+    def cost0_log(self, load):
+        '''
+        Same as cost0(), but computed in the log domain, see cost_log
+        '''
+        N = self.N
+        rho = load.get_load()
+        if N <= rho:
+            raise ArithmeticError("N should be larger than the load!")
+        j = numpy.arange(1, N + 1)
+        lp = numpy.concatenate(([0.0], numpy.cumsum(numpy.log(rho / j))))
+        h1 = rho / (N - rho)
+        lg1 = lp[N] + numpy.log(h1)
+        lnorm = numpy.logaddexp(_lse(lp), lg1)
+        L = numpy.exp(_lse(numpy.log(j) + lp[1:]) - lnorm)
+        L = L + numpy.exp(lg1 - lnorm) * (N + 1 + h1)
+        c = L * self.costs.c1 + N * self.costs.c2
+        return commons.Solution(float(c))
+
+
+    def cost1_log(self, m, K, load):
+        '''
+        Same as cost1(), but computed in the log domain, see cost_log
+        '''
+        lam = load.lam
+        mu = load.mu
+        nu = self.nu
+        N = self.N
+        rho = load.get_load()
+        if N <= rho:
+            raise ArithmeticError("N should be larger than the load!")
+        n = N - m
+        log = numpy.log
+
+        j = numpy.arange(1, K + 1)
+        lp = numpy.concatenate(([0.0], numpy.cumsum(log(rho) - log(numpy.minimum(j, n)))))
+        norm = [_lse(lp)]
+        mean = [_lse(log(j) + lp[1:])]
+
+        b = lam + n * mu + nu
+        z2 = (b + sqrt(b * b - 4 * n * lam * mu)) / (2 * lam)
+        h1 = 1 / (z2 - 1)
+        h2 = 1 / (N * mu - lam)
+        lg1 = lp[K] + log(h1)
+        lg1p = lg1 + log(K + 1 + h1)
+
+        if K + 1 >= N: # case 1
+            lg2 = lg1 + log(nu * z2 * h1 * h2)
+            lg2p = log(h2) + numpy.logaddexp(log(lam) + lg2, log(nu * z2 * h1) + lg1p)
+            lg2s = lg2
+        else:
+            # p2j, j=K+1,...,N-1
+            levels = numpy.arange(K + 1, N)
+            lzj = -log(z2) * numpy.arange(0, N - K - 1)
+            lp2 = self.__log_tail(load, levels, lg1 + lzj, -numpy.inf)
+            norm.append(_lse(lp2))
+            mean.append(_lse(log(levels) + lp2))
+            lg22 = log(h2) + numpy.logaddexp(log(lam) + lp2[-1], log(nu * h1) + lg1 + lzj[-1])
+            lg2s = numpy.logaddexp(norm[-1], lg22) # sum of all p2j
+            lg2p = log(h2) + _lse([log(lam) + lg22, log(N * lam) + lp2[-1],
+                                   log(nu * h1) + lzj[-1] +
+                                   numpy.logaddexp(log(N - K - 1) + lg1, lg1p)])
+            norm.pop()
+
+        norm.extend([lg1, lg2s])
+        mean.extend([lg1p, lg2p])
+        lnorm = _lse(norm)
+        g = numpy.exp(numpy.logaddexp(lg1, lg2s) - lnorm) # g1 + g2, normalized
+        L = numpy.exp(_lse(mean) - lnorm)
+        c = L * self.costs.c1 + (N - m * (1 - g)) * self.costs.c2
+        return commons.Solution(float(c), commons.Reserves(m, K, K))
+
+
+
+    def distribution(self, res, load, eps=DISTRIBUTION_EPS):
+        '''
+        Stationary distribution of the number of jobs in the system
+            * type res: commons.Reserves
+            * type load: commons.Load
+            * param eps: the distribution is truncated where the
+              probability of the remaining states falls below eps
+            * rtype: numpy array, the probability of j jobs, j=0,...,J
+        '''
+        reduced, full = self.__states(res, load, eps)
+        return reduced + full
+
+
+    def response_time(self, res, load, quantiles=(0.5, 0.95, 0.99), eps=DISTRIBUTION_EPS):
+        '''
+        Response time (waiting time plus service time) under FCFS. The mean
+        is L / lam (Little's law). For the percentiles, an arriving job
+        sees j jobs and s servers (s = N - m while the reserves are off or
+        powering up, s = N when they are on) with the stationary
+        probabilities; it waits for j - s + 1 departures at rate s * mu,
+        then it is served at rate mu. The number of servers is assumed not
+        to change during the wait (conservative while reserves power up).
+            * type res: commons.Reserves
+            * type load: commons.Load
+            * param quantiles: the quantiles to compute, in (0, 1)
+            * rtype: commons.Latency
+        '''
+        mean, survival = self.__response_time(res, load, eps)
+        mu = load.mu
+        values = []
+        for q in quantiles:
+            if not 0.0 < q < 1.0:
+                raise ValueError('quantiles must be in (0, 1): %s' % q)
+            hi = 1.0 / mu
+            while survival(hi) > 1.0 - q:
+                hi *= 2.0
+            lo = 0.0
+            while hi - lo > 1e-9 * hi:
+                mid = 0.5 * (lo + hi)
+                if survival(mid) > 1.0 - q:
+                    lo = mid
+                else:
+                    hi = mid
+            values.append(hi)
+        return commons.Latency(mean, quantiles, values)
+
+
+    def tail_probability(self, res, load, t, eps=DISTRIBUTION_EPS):
+        '''
+        Probability that the response time exceeds t, see response_time.
+        Cheaper than computing a percentile, as no search is required.
+            * type res: commons.Reserves
+            * type load: commons.Load
+            * rtype: float
+        '''
+        return self.__response_time(res, load, eps)[1](t)
+
+
+    def __response_time(self, res, load, eps):
+        '''
+        Mean response time and survival function P(response time > t)
+            * rtype: tuple (float, function of t)
+        '''
+        reduced, full = self.__states(res, load, eps)
+        mu = load.mu
+        jobs = numpy.arange(len(reduced))
+        mean = ((reduced + full) * jobs).sum() / load.lam
+        # for each number of servers: (probabilities, phases of the wait)
+        groups = [(reduced, numpy.maximum(jobs - (self.N - res.m) + 1, 0), self.N - res.m),
+                  (full, numpy.maximum(jobs - self.N + 1, 0), self.N)]
+
+        def survival(t):
+            total = 0.0
+            for probs, phases, s in groups:
+                if s == 0 or probs.sum() == 0.0:
+                    continue
+                # P(wait > t) = P(Poisson(s mu t) < phases)
+                tail = _log_poisson_tail(s * mu * t, int(phases.max()))
+                wait = -numpy.expm1(tail[phases])
+                # P(wait <= t, wait + service > t)
+                if s == 1:
+                    lf = numpy.concatenate(([0.0], numpy.cumsum(numpy.log(
+                        numpy.arange(1, phases.max() + 1)))))
+                    served = numpy.exp(-mu * t + phases * numpy.log(mu * t) - lf[phases])
+                else:
+                    c = (s - 1) * mu
+                    ltail = _log_poisson_tail(c * t, int(phases.max()))
+                    served = numpy.exp(-mu * t + phases * numpy.log(s * mu / c) +
+                                       ltail[phases])
+                total += (probs * (wait + served)).sum()
+            return min(total, 1.0)
+
+        return mean, survival
+
+
+    def __states(self, res, load, eps):
+        '''
+        Stationary probabilities of having j jobs, j=0,...,J, split by the
+        number of servers: N - m (reserves off or powering up) and N
+        (reserves on); J is chosen so that the probability of more jobs is
+        about eps
+            * rtype: tuple of numpy arrays
+        '''
+        m = res.m
+        D = res.D
+        U = res.U
+        lam = load.lam
+        mu = load.mu
+        N = self.N
+        rho = load.get_load()
+        if N <= rho:
+            raise ArithmeticError("N should be larger than the load!")
+        if m == 0:
+            D = U = 0
+        n = N - m
+        log = numpy.log
+
+        if m > 0:
+            b = lam + n * mu + self.nu
+            z2 = (b + sqrt(b * b - 4 * n * lam * mu)) / (2 * lam)
+            ratio = max(1.0 / z2, rho / N)
+        else:
+            ratio = rho / N
+        J = max(U, N) + int(ceil(log(eps) / log(ratio))) + 1
+        reduced = numpy.empty(J + 1)
+        reduced.fill(-numpy.inf)
+        full = reduced.copy()
+
+        if m == 0:
+            # M/M/N queue
+            j = numpy.arange(1, J + 1)
+            reduced[0] = 0.0
+            reduced[1:] = numpy.cumsum(log(rho) - log(numpy.minimum(j, N)))
+        else:
+            if D == U:
+                j = numpy.arange(1, U + 1)
+                reduced[0] = 0.0
+                reduced[1:U + 1] = numpy.cumsum(log(rho) - log(numpy.minimum(j, n)))
+                lp0U = reduced[U]
+                lg1 = lp0U - log(z2 - 1)
+                lx0 = -numpy.inf
+                top = lp0U # log (p0U + p1U)
+            else:
+                lp, lr, lp0U, lp1, lp2, lg1, z2, h1, _ = self.__log_head(res, load)
+                K = U - D
+                reduced[0:D + 1] = lp
+                reduced[D + 1:U] = lr[:K - 1][::-1] + lp0U
+                reduced[U] = lp0U
+                reduced[D + 1:U + 1] = numpy.logaddexp(reduced[D + 1:U + 1], lp1)
+                full[D + 1:U + 1] = lp2
+                lx0 = lp2[K - 1]
+                top = numpy.logaddexp(lp0U, lp1[K - 1])
+            # above U: p1j = (p0U + p1U) * z2^-(j-U), p2j from the cut equations
+            levels = numpy.arange(U + 1, J + 1)
+            reduced[U + 1:] = top - (levels - U) * log(z2)
+            full[U + 1:] = self.__log_tail(load, levels, lg1 - (levels - U - 1) * log(z2),
+                                           lx0)
+
+        lnorm = numpy.logaddexp(_lse(reduced), _lse(full))
+        return numpy.exp(reduced - lnorm), numpy.exp(full - lnorm)
+
+
+
+class MultiTierRes():
+    '''
+    Evaluates the cost function when the reserves are split into tiers
+    (commons.Tiers), each one powered up when the number of jobs exceeds
+    its U and powered down when it drops to its D, independently of the
+    others. With a single tier the model is the one of AnnOperRes.
+    
+    The model is a quasi birth-death process: the level is the number of
+    jobs, the phase the state of the tiers (off, powering up, on), i.e.,
+    3^k phases for k tiers. The levels up to T = max(N, U1, ..., Uk,
+    D1 + 1, ..., Dk + 1) are solved by block elimination; above T the
+    process is level independent and the levels are given by the
+    matrix-geometric solution.
+    '''
+    
+    
+    def __init__(self, N, nu, c1, c2):
+        self.N = N
+        self.nu = nu
+        self.costs = commons.Costs(c1, c2)
+        self.__phases = {} # number of tiers -> phases (one row per phase)
         
-       
+        
+    def cost(self, tiers, load):
+        '''
+        Computes the cost for the given tiers and load
+            * type tiers: commons.Tiers
+            * type load: commons.Load
+            * rtype: commons.Solution, with reserves the tiers
+        '''
+        if len(tiers) == 0:
+            sol = AnnOperRes(self.N, self.nu, self.costs.c1, self.costs.c2).cost0(load)
+            return commons.Solution(sol.cost, tiers)
+        if tiers.m >= self.N:
+            raise ValueError('At least one server must be always on: %s' % tiers)
+        if self.N <= load.get_load():
+            raise ArithmeticError("N should be larger than the load!")
+        
+        L, off = self.__solve(tiers, load)
+        powered = self.N - sum(t.m * p for t, p in zip(tiers, off))
+        c = L * self.costs.c1 + powered * self.costs.c2
+        return commons.Solution(float(c), tiers)
+    
+    
+    def __states(self, k):
+        '''
+        Phases for k tiers: one row per phase, the state of each tier
+        (0 off, 1 powering up, 2 on); phase i has digits i in base 3
+        '''
+        phases = self.__phases.get(k)
+        if phases is None:
+            index = numpy.arange(3 ** k)
+            phases = numpy.array([(index // 3 ** i) % 3 for i in xrange(k)]).T
+            self.__phases[k] = phases
+        return phases
+    
+    
+    def __blocks(self, tiers, load, j, phases, m, D, U):
+        '''
+        Transition rates from level j: up (arrivals), local (power up
+        completed, diagonal included) and down (departures)
+        '''
+        P = len(phases)
+        weights = 3 ** numpy.arange(len(tiers))
+        rows = numpy.arange(P)
+        
+        up = numpy.zeros((P, P))
+        # the tiers that are off start powering up above U
+        target = numpy.where((phases == 0) & (j >= U), 1, phases)
+        up[rows, target.dot(weights)] = load.lam
+        
+        down = numpy.zeros((P, P))
+        if j > 0:
+            # the tiers that are not off are switched off at D
+            target = numpy.where((phases > 0) & (j - 1 <= D), 0, phases)
+            servers = self.N - ((phases != 2) * m).sum(axis=1)
+            down[rows, target.dot(weights)] = numpy.minimum(j, servers) * load.mu
+        
+        local = numpy.zeros((P, P))
+        for i in xrange(len(tiers)):
+            powering = rows[phases[:, i] == 1]
+            local[powering, powering + weights[i]] = self.nu
+        local[rows, rows] = -(up.sum(axis=1) + local.sum(axis=1) + down.sum(axis=1))
+        return up, local, down
+    
+    
+    def __solve(self, tiers, load):
+        '''
+        Solves the process
+            * rtype: tuple (average number of jobs, probability that each
+              tier is off)
+        '''
+        k = len(tiers)
+        phases = self.__states(k)
+        P = len(phases)
+        m = numpy.array([t.m for t in tiers])
+        D = numpy.array([t.D for t in tiers])
+        U = numpy.array([t.U for t in tiers])
+        T = max(self.N, int(U.max()), int(D.max()) + 1)
+        I = numpy.eye(P)
+        
+        # level independent part, j > T: p(j + 1) = p(j) R
+        up, local, down = self.__blocks(tiers, load, T + 1, phases, m, D, U)
+        R = self.__rate_matrix(up, local, down)
+        
+        # block elimination, from level T down to 0: p(j + 1) = p(j) Rj
+        Rs = [None] * T
+        _, local, cur = self.__blocks(tiers, load, T, phases, m, D, U)
+        A = local + R.dot(down) # level T, including the levels above
+        for j in xrange(T, 0, -1):
+            up, local, down = self.__blocks(tiers, load, j - 1, phases, m, D, U)
+            Rs[j - 1] = up.dot(numpy.linalg.inv(-A))
+            A = local + Rs[j - 1].dot(cur)
+            cur = down
+            
+        # p(0) A = 0, normalized later; all the tiers are off with no jobs
+        A[:, 0] = 1.0
+        rhs = numpy.zeros(P)
+        rhs[0] = 1.0
+        p = numpy.linalg.solve(A.T, rhs)
+        
+        # forward pass, rescaling the levels to avoid overflow
+        scale = 0.0 # log of the scale factor of the current level
+        scales = [0.0]
+        levels = [p]
+        for j in xrange(1, T + 1):
+            p = p.dot(Rs[j - 1])
+            top = p.max()
+            if top > 1e100 or 0.0 < top < 1e-100:
+                p = p / top
+                scale += log(top)
+            levels.append(p)
+            scales.append(scale)
+        
+        # the levels are summed with the scale of the largest one
+        top = max(scales)
+        total = numpy.zeros(P)
+        mean = numpy.zeros(P)
+        for j in xrange(T + 1):
+            w = exp(scales[j] - top)
+            total += w * levels[j]
+            mean += j * w * levels[j]
+        # levels above T: sum_n p(T) R^n and sum_n (T + n) p(T) R^n, n >= 1
+        w = exp(scales[T] - top)
+        inv = numpy.linalg.inv(I - R)
+        tail = w * levels[T].dot(R).dot(inv)
+        total += tail
+        mean += T * tail + tail.dot(inv)
+        
+        norm = total.sum()
+        L = mean.sum() / norm
+        off = [total[phases[:, i] == 0].sum() / norm for i in xrange(k)]
+        return L, off
+    
+    
+    def __rate_matrix(self, up, local, down, eps=1e-14, max_iter=64):
+        '''
+        Minimal solution of up + R local + R^2 down = 0, computed from the
+        matrix G (up G^2 + local G + down = 0) by logarithmic reduction
+        '''
+        P = len(local)
+        I = numpy.eye(P)
+        inv = numpy.linalg.inv(-local)
+        H = inv.dot(up)
+        L = inv.dot(down)
+        G = L.copy()
+        T = H.copy()
+        for _ in xrange(max_iter):
+            W = numpy.linalg.inv(I - H.dot(L) - L.dot(H))
+            H = W.dot(H.dot(H))
+            L = W.dot(L.dot(L))
+            G = G + T.dot(L)
+            T = T.dot(H)
+            if numpy.abs(1.0 - G.sum(axis=1)).max() < eps:
+                break
+        return up.dot(numpy.linalg.inv(-(local + up.dot(G))))
+
+
+
+class IncrementalCost():
+    '''
+    Evaluates the cost function of AnnOperRes for a fixed load, keeping the
+    partial results of the recursions so that neighbouring configurations
+    (m, D +/- 1, U +/- 1) can be evaluated without starting from scratch:
+        * the probabilities p0j, j=0,...,D depend only on m
+        * the constants r(j) depend only on (m, U)
+        * the constants aj depend only on (m, D)
+        * the p2j, j=U+1,...,N-1, are linear in g1 and p2U, with
+          coefficients that depend only on (m, U)
+    Only the p1j/p2j, j=D+1,...,U, are computed at each call.
+    '''
+
+
+    def __init__(self, N, nu, c1, c2, load):
+        '''
+        Constructor
+            * N: total number of servers
+            * nu: rate required to power on servers
+            * c1: holding cost
+            * c2: cost for servers
+            * type load: commons.Load
+        '''
+        self.N = N
+        self.nu = nu
+        self.costs = commons.Costs(c1, c2)
+        self.lam = load.lam
+        self.mu = load.mu
+        self.model = AnnOperRes(N, nu, c1, c2)
+        self.load = load
+        self.clear()
+
+
+    def clear(self):
+        '''
+        Discards the partial results
+        '''
+        self.__cost0 = None
+        self.__roots = {}  # m -> (z1, z2, h1)
+        self.__prefix = {} # m -> ([p0j], [sum p0j], [sum j*p0j]), j=0,...
+        self.__r = {}      # (m, U) -> ([r(j)], [sum r], [sum (U-j-1)*r])
+        self.__aj = {}     # (m, D) -> [aD+1, aD+2, ...]
+        self.__tail = {}   # (m, U) -> coefficients of the p2j, j > U
+        self.__p1 = []     # partial sums of the p1j, reused across calls
+
+
+    def same_load(self, load):
+        '''
+        Returns True if this evaluator can be used for the given load
+        '''
+        return self.lam == load.lam and self.mu == load.mu
+
+
+    def cost(self, res):
+        '''
+        Computes the cost for the given reserves, see AnnOperRes.cost
+            * type res: commons.Reserves
+            * rtype: commons.Solution
+        '''
+        m = res.m
+        D = res.D
+        U = res.U
+        if m == 0:
+            if self.__cost0 is None:
+                self.__cost0 = self.model.cost0(self.load)
+            return self.__cost0
+        if D == U:
+            return self.model.cost1(m, U, self.load)
+        if self.N == self.lam / self.mu:
+            raise ArithmeticError("N should be larger than the load!")
+
+        lam = self.lam
+        mu = self.mu
+        nu = self.nu
+        N = self.N
+        n = N - m
+        K = U - D
+        z1, z2, h1 = self.__get_roots(m)
+        h2 = 1 / (N * mu - lam)
+        m1 = 1 / mu
+        if isinf(h2):
+            raise ArithmeticError("h2 is infinity!")
+
+        # p0j, j=0,...,D
+        p, s, w = self.__get_prefix(m, D)
+        p0 = s[D]
+        L = w[D]
+
+        # p0j, j=D+1,...,U
+        r, rs, rw = self.__get_r(m, U, K)
+        p0U = p[D] / r[K - 1]
+        p0 = p0 + p0U + rs[K - 1] * p0U
+        L = L + U * p0U + rw[K - 1] * p0U
+        norm = p0
 
+        # p1U
+        aj = self.__get_aj(m, D, K - 1)
+        a = 0.0
+        if K > 1:
+            a = aj[K - 2]
+        p1j = p0U * lam * z1 / (lam + nu + min(U, n) * mu - lam * a - lam * z1)
+        norm = norm + p1j
+        L = L + U * p1j
+
+        # p1j backwards, and their partial sums
+        p1 = self.__p1
+        if len(p1) < K:
+            p1.extend([0.0] * (K - len(p1)))
+        psum = p1j
+        p1[K - 1] = psum
+        for j in xrange(K - 2, -1, -1):
+            p1j = aj[j] * p1j
+            norm = norm + p1j
+            L = L + (D + (j + 1)) * p1j
+            psum = psum + p1j
+            p1[j] = psum
+
+        # p2j, j=D+1,...,U
+        g1 = (p0U + p1[K - 1]) * h1
+        g1p = g1 * (U + 1 + h1)
+        p2 = 0.0
+        for j in xrange(0, K):
+            p2 = ((p1[j] + g1) * nu + p2 * lam) * m1 / min(D + j + 1, N)
+            norm = norm + p2
+            L = L + (D + j + 1) * p2
+
+        # p2j, j=U+1,...,N-1
+        if U + 1 < N:
+            sa, sb, wa, wb, a_last, b_last, zj = self.__get_tail(m, U, z2)
+            norm = norm + g1 * sa + p2 * sb
+            L = L + g1 * wa + p2 * wb
+            p2 = a_last * g1 + b_last * p2
+            g2 = (lam * p2 + nu * g1 * zj * h1) * h2
+            g2p = (lam * (g2 + N * p2) + nu * g1 * zj * h1 * (N + h1)) * h2
+        else:
+            g2 = (lam * p2 + nu * g1 * z2 * h1) * h2
+            g2p = (lam * (g2 + (U + 1) * p2) + nu * g1 * z2 * h1 * (U + 1 + h1)) * h2
+
+        norm = norm + g1 + g2
+        L = L + g1p + g2p
+        p0 = p0 / norm
+        L = L / norm
+        c = L * self.costs.c1 + (N - m * p0) * self.costs.c2
+        if isinf(c) or isnan(c): # overflow, see AnnOperRes.cost_log
+            return self.model.cost_log(res, self.load)
+        return commons.Solution(c, res)
+
+
+    def __get_roots(self, m):
+        roots = self.__roots.get(m)
+        if roots is None:
+            n = self.N - m
+            b = self.lam + n * self.mu + self.nu
+            delta = sqrt(b * b - 4 * n * self.lam * self.mu)
+            z1 = (b - delta) / (2 * self.lam)
+            z2 = (b + delta) / (2 * self.lam)
+            roots = (z1, z2, 1 / (z2 - 1))
+            self.__roots[m] = roots
+        return roots
+
+
+    def __get_prefix(self, m, D):
+        prefix = self.__prefix.get(m)
+        if prefix is None:
+            prefix = ([1.0], [1.0], [0.0])
+            self.__prefix[m] = prefix
+        p, s, w = prefix
+        rho = self.lam / self.mu
+        n = self.N - m
+        for j in xrange(len(p), D + 1):
+            p.append(p[j - 1] * rho / min(j, n))
+            s.append(s[j - 1] + p[j])
+            w.append(w[j - 1] + j * p[j])
+        return prefix
+
+
+    def __get_r(self, m, U, K):
+        key = (m, U)
+        rr = self.__r.get(key)
+        if rr is None:
+            n = self.N - m
+            r0 = 1 + self.mu * min(U, n) / self.lam
+            rr = ([r0], [0.0], [0.0])
+            self.__r[key] = rr
+        r, rs, rw = rr
+        n = self.N - m
+        for j in xrange(len(r), K):
+            r.append(1 + r[j - 1] * self.mu * min(U + 1 - (j + 1), n) / self.lam)
+            rs.append(rs[j - 1] + r[j - 1])
+            rw.append(rw[j - 1] + (U - j) * r[j - 1])
+        return rr
+
+
+    def __get_aj(self, m, D, size):
+        key = (m, D)
+        aj = self.__aj.get(key)
+        if aj is None:
+            aj = []
+            self.__aj[key] = aj
+        n = self.N - m
+        lam = self.lam
+        mu = self.mu
+        for j in xrange(len(aj), size):
+            bj = lam + self.nu + min(D + (j + 1), n) * mu
+            if j == 0:
+                aj.append(min(D + 2, n) * mu / bj)
+            else:
+                aj.append(min(D + (j + 1) + 1, n) * mu / (bj - lam * aj[j - 1]))
+        return aj
+
+
+    def __get_tail(self, m, U, z2):
+        key = (m, U)
+        tail = self.__tail.get(key)
+        if tail is None:
+            # p2j = A(j) * g1 + B(j) * p2U, j=U+1,...,N-1
+            lam = self.lam
+            m1 = 1 / self.mu
+            A = 0.0
+            B = 1.0
+            sa = sb = wa = wb = 0.0
+            zj = 1.0
+            for j in xrange(U + 1, self.N):
+                A = (self.nu * zj + A * lam) * m1 / j
+                B = B * lam * m1 / j
+                sa = sa + A
+                sb = sb + B
+                wa = wa + j * A
+                wb = wb + j * B
+                if j < self.N - 1:
+                    zj = zj / z2
+            tail = (sa, sb, wa, wb, A, B, zj)
+            self.__tail[key] = tail
+        return tail
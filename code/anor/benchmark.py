@@ -0,0 +1,217 @@
+# Copyright (C) 2013 Michele Mazzucco
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Benchmarks for the evaluation of the cost function and checks of the
+search algorithms.
+'''
+
+import time
+import random
+import argparse
+
+import anor, commons, algorithms, cache
+
+
+class LegacyWorkspace():
+    '''
+    The buffers of AnnOperRes.cost before anor.Workspace: new NumPy arrays
+    on every call, for comparison
+    '''
+
+
+    def __init__(self, evaluator):
+        self.zeros = evaluator.zeros
+        
+        
+    def reserve(self, size):
+        self.r = self.zeros(size)
+        self.p1j = self.zeros(size)
+        self.bj = self.zeros(size)
+        self.aj = self.zeros(size)
+        self.p1 = self.zeros(size)
+
+
+def cost_rate(N, load, U, nu=1.0 / 60, c1=1.2, c2=1.0, duration=1.0, legacy=False):
+    '''
+    Measures how many evaluations per second AnnOperRes.cost performs for
+    configurations with upper threshold U (the reserves and the lower
+    threshold vary across the calls)
+        * type load: commons.Load
+        * param legacy: if True, the buffers are allocated on every call,
+          see LegacyWorkspace
+        * rtype: float
+    '''
+    evaluator = anor.AnnOperRes(N, nu, c1, c2)
+    if legacy:
+        evaluator.workspace = LegacyWorkspace(evaluator)
+    configurations = []
+    for m in xrange(1, N):
+        for D in xrange(0, U, max(1, U / 10)):
+            configurations.append(commons.Reserves(m, D, U))
+
+    count = 0
+    start = time.time()
+    elapsed = 0.0
+    while elapsed < duration:
+        for res in configurations:
+            evaluator.cost(res, load)
+        count += len(configurations)
+        elapsed = time.time() - start
+    return count / elapsed
+
+
+def load_lambdas(path, scale=1.0):
+    '''
+    Loads the arrival rates of a trace (one per line, '#' starts a comment)
+        * param scale: the arrival rates are multiplied by this factor
+        * rtype: list of floats
+    '''
+    lambdas = []
+    with open(path) as in_file:
+        for line in in_file:
+            if line.startswith('#') or not line.strip():
+                continue
+            lambdas.append(float(line.split()[0]) * scale)
+    return lambdas
+
+
+def check_unimodal(N, lambdas, mu, nu=1.0 / 60, c1=1.2, c2=1.0, tol=1e-9):
+    '''
+    Compares algorithms.Unimodal with algorithms.Exhaustive on the given
+    arrival rates
+        * param tol: relative difference of the costs accepted
+        * rtype: tuple (list of (lam, exhaustive solution, unimodal solution)
+          where Unimodal is worse, evaluations made by Exhaustive, evaluations
+          made by Unimodal)
+    '''
+    exhaustive = algorithms.Exhaustive(N, nu, c1, c2, cache.CostCache())
+    unimodal = algorithms.Unimodal(N, nu, c1, c2)
+    mismatches = []
+    evaluations = [0, 0]
+    for lam in sorted(set(lambdas)):
+        load = commons.Load(lam, mu)
+        expected = exhaustive.exhaustive_search(load)
+        found = unimodal.search(load)
+        evaluations[0] += exhaustive.evaluations
+        evaluations[1] += unimodal.evaluations
+        if found.get_cost() > expected.get_cost() * (1.0 + tol):
+            mismatches.append((lam, expected, found))
+    return mismatches, evaluations[0], evaluations[1]
+
+
+def check_log_domain(N, load, samples=1000, nu=1.0 / 60, c1=1.2, c2=1.0, seed=0):
+    '''
+    Compares AnnOperRes.cost_log with AnnOperRes.cost on random
+    configurations (D, U < 3N) where the latter is finite
+        * rtype: tuple (largest relative difference, configurations compared)
+    '''
+    evaluator = anor.AnnOperRes(N, nu, c1, c2)
+    rng = random.Random(seed)
+    worst = 0.0
+    count = 0
+    for _ in xrange(samples):
+        m = rng.randint(0, N - 1)
+        D = rng.randint(0, 3 * N)
+        U = rng.randint(D, 3 * N)
+        if D == U and U < N - m - 1:
+            continue
+        res = commons.Reserves(m, D, U)
+        expected = evaluator.cost(res, load).get_cost()
+        if expected != expected or abs(expected) == float('inf'):
+            continue
+        found = evaluator.cost_log(res, load).get_cost()
+        worst = max(worst, abs(found - expected) / abs(expected))
+        count += 1
+    return worst, count
+
+
+def check_warm_start(N, lambdas, mu, nu=1.0 / 60, c1=1.2, c2=1.0, budget=0.1):
+    '''
+    Checks that algorithms.WarmStart configures the annealing in the same
+    way whether the arrival rates are integers or floats
+        * param lambdas: integer arrival rates
+        * param budget: seconds per search
+        * rtype: list of (lam, settings with integer rates, settings with
+          float rates) that differ, where the settings are tuples (max_iter,
+          max_temp, radius of the region, None if not restricted)
+    '''
+    def settings(rates):
+        warm = algorithms.WarmStart(N, nu, c1, c2)
+        found = []
+        for lam in rates:
+            warm.solve(commons.Load(lam, mu), time.time() + budget)
+            sa = warm.annealing
+            found.append((sa.max_iter, sa.max_temp, None if sa.region is None else sa.region[1]))
+        return found
+
+    mismatches = []
+    for lam, found, expected in zip(lambdas, settings([int(lam) for lam in lambdas]),
+                                    settings([float(lam) for lam in lambdas])):
+        if found != expected:
+            mismatches.append((lam, found, expected))
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cost function micro-benchmark')
+    parser.add_argument('-N', type=int, required=False, default=20,
+                        help='Number of servers [default 20]')
+    parser.add_argument('-lam', type=float, required=False, default=40.0,
+                        help='Arrival rate [default 40.0]')
+    parser.add_argument('-mu', type=float, required=False, default=4.35,
+                        help='Service rate [default 4.35]')
+    parser.add_argument('-d', type=float, required=False, default=1.0,
+                        help='Seconds per measurement [default 1.0]')
+    parser.add_argument('-check', required=False, default=None,
+                        help='Trace; if given, compares the unimodal and exhaustive '
+                        'searches on its arrival rates instead')
+    parser.add_argument('-scale', type=float, required=False, default=1.5,
+                        help='Scale factor of the trace, as in main [default 1.5]')
+    parser.add_argument('-log', action='store_true',
+                        help='Compares the log domain and the standard evaluation instead')
+    parser.add_argument('-warm', action='store_true',
+                        help='Checks the warm start with integer arrival rates instead')
+    args = parser.parse_args()
+
+    if args.warm:
+        lam = int(args.lam)
+        lambdas = [lam, lam + 1, lam + lam / 10, 2 * lam - 1, lam]
+        mismatches = check_warm_start(args.N, lambdas, args.mu)
+        for lam, found, expected in mismatches:
+            print 'lam %d: integer rates %s, float rates %s' % (lam, found, expected)
+        print '%d arrival rates, %d mismatches' % (len(lambdas), len(mismatches))
+        raise SystemExit(len(mismatches) > 0)
+
+    if args.log:
+        worst, count = check_log_domain(args.N, commons.Load(args.lam, args.mu))
+        print '%d configurations, largest relative difference %.3e' % (count, worst)
+        raise SystemExit(worst > 1e-9)
+
+    if args.check is not None:
+        lambdas = load_lambdas(args.check, args.scale)
+        mismatches, e1, e2 = check_unimodal(args.N, lambdas, args.mu)
+        for lam, expected, found in mismatches:
+            print 'lam %.3f: exhaustive %s, unimodal %s' % (lam, expected, found)
+        print '%d arrival rates, %d mismatches, evaluations: exhaustive %d, unimodal %d' % (
+            len(set(lambdas)), len(mismatches), e1, e2)
+        raise SystemExit(len(mismatches) > 0)
+
+    load = commons.Load(args.lam, args.mu)
+    print '%6s %12s %12s %8s' % ('U', 'before', 'after', 'speed-up')
+    for U in xrange(args.N / 2, 3 * args.N + 1, max(1, args.N / 2)):
+        before = cost_rate(args.N, load, U, duration=args.d, legacy=True)
+        after = cost_rate(args.N, load, U, duration=args.d)
+        print '%6d %12.1f %12.1f %8.2f' % (U, before, after, after / before)
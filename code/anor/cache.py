@@ -0,0 +1,95 @@
+# Copyright (C) 2013 Michele Mazzucco
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Bounded cache of the evaluations of the cost function, shared by the
+search algorithms.
+'''
+
+from collections import OrderedDict
+
+
+# Default max number of solutions kept in the cache
+DEFAULT_MAX_SIZE = 50000
+
+
+class CostCache():
+    '''
+    LRU cache of commons.Solution objects, keyed on
+    (N, nu, c1, c2, lam, mu, m, D, U).
+    '''
+
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        '''
+        Constructor
+            * max_size: max number of solutions kept in the cache; the least
+              recently used one is discarded when the cache is full
+        '''
+        if max_size < 1:
+            raise ValueError('max_size must be positive: %d' % max_size)
+        self.max_size = max_size
+        self.__entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def cost(self, N, nu, costs, res, load, evaluate):
+        '''
+        Returns the solution for the given parameters, computing it only if
+        it is not in the cache
+            * type costs: commons.Costs
+            * type res: commons.Reserves
+            * type load: commons.Load
+            * param evaluate: function (res, load) -> commons.Solution, used
+              on a cache miss
+            * rtype: commons.Solution
+        '''
+        key = (N, nu, costs.c1, costs.c2, load.lam, load.mu, res.m, res.D, res.U)
+        try:
+            sol = self.__entries.pop(key)
+            self.hits += 1
+        except KeyError:
+            sol = evaluate(res, load)
+            self.misses += 1
+            if len(self.__entries) >= self.max_size:
+                self.__entries.popitem(last=False)
+        self.__entries[key] = sol
+        return sol
+
+
+    def size(self):
+        '''
+        Gets the number of solutions in the cache
+        '''
+        return len(self.__entries)
+
+
+    def clear(self):
+        '''
+        Discards all the solutions and resets the counters
+        '''
+        self.__entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+    def __str__(self):
+        return 'size %d/%d, hits %d, misses %d' % (len(self.__entries),
+                                                  self.max_size, self.hits, self.misses)
+
+
+# Cache used by the algorithms when none is specified
+shared = CostCache()
@@ -19,8 +19,11 @@ Created on Feb 21, 2012
 @author: michele
 '''
 
+from collections import namedtuple
+
+import numpy
+
 import anor
-import decimal
 
 
 class Costs:
@@ -72,11 +75,15 @@ class Load:
     
     
     
-class Reserves:
+class Reserves(namedtuple('Reserves', 'm D U')):
     '''
-    Reserves, i.e., triple(m, D, U)
+    Reserves, i.e., triple(m, D, U). Immutable (a tuple), so that it can be
+    used as a dictionary key; the ordering is the one of the tuple.
     '''
-    def __init__(self, m=0, D=0, U=0):
+    __slots__ = ()
+    
+    
+    def __new__(cls, m=0, D=0, U=0):
         '''
         * The number of reserves
         * The lower threshold
@@ -87,10 +94,8 @@ class Reserves:
         if D < 0:
             raise ValueError('D cannot be negative %d' % D)
         if U < D:
-            raise ValueError('U cannot smaller than D: U %d, D %d' % U, D)
-        self.m = m
-        self.D = D
-        self.U = U
+            raise ValueError('U cannot smaller than D: U %d, D %d' % (U, D))
+        return super(Reserves, cls).__new__(cls, m, D, U)
         
         
     def create_solution(self, N, nu, cost, load):
@@ -99,52 +104,88 @@ class Reserves:
         '''
         c = anor.AnnOperRes(N, nu, cost.get_c1(), cost.get_c2())
         return c.cost(self, load)
-        
-    def __key(self):
-        return (self.m, self.D, self.U)
-        
-    def __hash__(self):
-        return hash(self.__key())
+    
     
     def __str__(self):
-        return "m=%d, D=%d, U=%d" % (self.m, self.D, self.U) 
-    
-    def __eq__(self, other):
-        if not isinstance(other, Reserves):
-            return False
-        if self.D != other.D:
-            return False
-        if self.U != other.U:
-            return False
-        if self.m != other.m:
-            return False
-        
-    def __cmp__(self, other):
-        if self.m < other.m:
-            return -1
-        elif self.m > other.m:
-            return 1
-        else:
-            if self.U < other.U:
-                return -1
-            elif self.U > other.U:
-                return 1
-            else:
-                if self.D < other.D:
-                    return -1
-                elif self.D > other.D:
-                    return 1
-                else:
-                    return 0
-                
+        return "m=%d, D=%d, U=%d" % (self.m, self.D, self.U)
+
+
+class Tiers(tuple):
+    '''
+    Reserves split into tiers, i.e., blocks of reserves powered up and down
+    independently, each one with its own thresholds. Immutable; the tiers
+    are sorted by U, then by D, so that equal policies are equal tuples.
+    m is the total number of reserves, D and U the thresholds of the first
+    tier (the first to be powered up), so that a Tiers object can be used
+    wherever the Reserves are only reported.
+    '''
+    __slots__ = ()
+
+
+    def __new__(cls, tiers=()):
+        '''
+        * tiers: sequence of Reserves, each one with at least one reserve
+        '''
+        tiers = sorted(tiers, key=lambda t: (t.U, t.D, t.m))
+        for t in tiers:
+            if not isinstance(t, Reserves):
+                raise TypeError('Expected Reserves, got %s' % type(t))
+            if t.m == 0:
+                raise ValueError('Empty tier %s' % t)
+        return super(Tiers, cls).__new__(cls, tiers)
+
+
+    @staticmethod
+    def split(res, count, step=1):
+        '''
+        Splits a block of reserves into (at most) count tiers with the same
+        thresholds
+            * type res: Reserves
+            * param step: the size of the tiers is a multiple of step (e.g.,
+              the number of cores per server); the remainder is dropped
+            * rtype: Tiers
+        '''
+        blocks = res.m / step
+        tiers = []
+        for i in xrange(count):
+            size = blocks / count + (1 if i < blocks % count else 0)
+            if size > 0:
+                tiers.append(Reserves(size * step, res.D, res.U))
+        return Tiers(tiers)
+
+
+    @property
+    def m(self):
+        return sum(t.m for t in self)
+
+
+    @property
+    def D(self):
+        return self[0].D if len(self) > 0 else 0
+
+
+    @property
+    def U(self):
+        return self[0].U if len(self) > 0 else 0
+
+
+    def __str__(self):
+        if len(self) == 0:
+            return 'm=0'
+        return '; '.join(t.__str__() for t in self)
+
                 
-class Solution:
+class Solution(namedtuple('Solution', 'cost reserves')):
     '''
-    Solution of the search methods
+    Solution of the search methods. Immutable (a tuple): two solutions are
+    equal if they have the same cost and reserves, and are ordered by cost
+    (as floats), then by reserves.
     '''
-    def __init__(self, cost, reserves=Reserves(0,0,0)):
-        self.cost = cost
-        self.reserves = reserves
+    __slots__ = ()
+    
+    
+    def __new__(cls, cost, reserves=Reserves(0, 0, 0)):
+        return super(Solution, cls).__new__(cls, cost, reserves)
         
     
     def get_cost(self):
@@ -188,37 +229,125 @@ class Solution:
         Returns a string representation of this cost object
         '''
         return "Cost %s, cost %.10f" % (self.reserves.__str__(), self.cost)
+
+
+# packed form of a solution, see SolutionArray
+SOLUTION_RECORD = numpy.dtype([('m', '<i4'), ('D', '<i4'), ('U', '<i4'), ('cost', '<f8')])
+
+
+class SolutionArray:
+    '''
+    Packed storage of many solutions (20 bytes each), e.g., the solutions
+    visited by a search. The buffer grows geometrically.
+    '''
+    def __init__(self, size=64):
+        self.__records = numpy.empty(size, dtype=SOLUTION_RECORD)
+        self.__len = 0
+        
+        
+    def append(self, sol):
+        '''
+        Adds a solution
+            * type sol: Solution
+        '''
+        if self.__len == len(self.__records):
+            self.__records = numpy.resize(self.__records, max(1, 2 * self.__len))
+        res = sol.reserves
+        self.__records[self.__len] = (res.m, res.D, res.U, sol.cost)
+        self.__len += 1
+        
+        
+    def records(self):
+        '''
+        Gets the solutions (a view, valid until the next append)
+            * rtype: numpy array of SOLUTION_RECORD
+        '''
+        return self.__records[:self.__len]
     
     
-    def __key(self):
-        # the cost is not necessary
-        return (self.reserves.m, self.reserves.D, self.reserves.U)
+    def best(self):
+        '''
+        Gets the solution with the lowest cost (the first one, in case of
+        ties), or None if there are no solutions
+            * rtype: Solution
+        '''
+        if self.__len == 0:
+            return None
+        return self[int(numpy.argmin(self.records()['cost']))]
+    
+    
+    def __getitem__(self, i):
+        if not -self.__len <= i < self.__len:
+            raise IndexError(i)
+        m, D, U, cost = self.__records[i % self.__len].tolist()
+        return Solution(cost, Reserves(m, D, U))
     
+    
+    def __len__(self):
+        return self.__len
+
+
+class Result:
+    '''
+    Outcome of an anytime search: the best solution found, together with
+    some information about its quality
+    '''
+    def __init__(self, solution, baseline, evaluations, elapsed, complete):
+        '''
+        * solution: the best solution found (Solution)
+        * baseline: the solution of the heuristic (Solution)
+        * evaluations: number of evaluations of the cost function
+        * elapsed: duration of the search, in seconds
+        * complete: False if the search has been stopped by the deadline
+        '''
+        self.solution = solution
+        self.baseline = baseline
+        self.evaluations = evaluations
+        self.elapsed = elapsed
+        self.complete = complete
         
-    def __hash__(self):
-        return hash(self.__key())
-
-    
-    def __eq__(self, other):
-        if not isinstance(other, Reserves):
-            return False
-        if self.reserves.D != other.D:
-            return False
-        if self.reserves.U != other.U:
-            return False
-        if self.reserves.m != other.m:
-            return False
         
+    def get_gap(self):
+        '''
+        Gets the relative difference between the cost of the solution and
+        the cost of the heuristic (negative if the solution is better)
+        '''
+        return (self.solution.cost - self.baseline.cost) / self.baseline.cost
+    
+    
+    def __str__(self):
+        return '%s, gap %+.4f%%, %d evaluations, %.3f sec.%s' % (
+            self.solution.__str__(), 100.0 * self.get_gap(), self.evaluations,
+            self.elapsed, '' if self.complete else ' (deadline expired)')
+
+
+class Latency:
+    '''
+    Response time of a configuration: the mean and some percentiles
+    '''
+    def __init__(self, mean, quantiles, values):
+        '''
+        * mean: mean response time
+        * quantiles: the quantiles, e.g., [0.5, 0.95, 0.99]
+        * values: the corresponding percentiles of the response time
+        '''
+        self.mean = mean
+        self.percentiles = dict(zip(quantiles, values))
         
         
-    def __cmp__(self, other):
+    def get_mean(self):
+        return self.mean
+    
+    
+    def get_percentile(self, quantile):
         '''
-        Compares the cost fields
+        Gets the percentile for the given quantile (e.g., 0.99 for p99)
         '''
-        if isinstance(other, Solution):
-            tmp1 = decimal.Decimal(self.cost)
-            tmp2 = decimal.Decimal(other.cost)
-            return tmp1.compare(tmp2)
-        raise BaseException("Expected EstimatedCost object")
-
-            
+        if quantile not in self.percentiles:
+            raise ValueError('Percentile %s not computed' % quantile)
+        return self.percentiles[quantile]
+    
+    
+    def __str__(self):
+        return 'mean %.4f, %s' % (self.mean, ', '.join(
+            'p%g %.4f' % (100 * q, self.percentiles[q]) for q in sorted(self.percentiles)))
@@ -0,0 +1,179 @@
+# Copyright (C) 2013 Michele Mazzucco
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Policy table: the solutions (m, D, U) computed offline for a grid of
+arrival rates, so that the monitor can reconfigure the reserves without
+running a solver.
+
+The table is stored in a binary file made of a fixed size header followed
+by one record per arrival rate, sorted by arrival rate. The records are
+accessed through a memory map.
+'''
+
+import struct
+import argparse
+import multiprocessing
+from bisect import bisect_left
+
+import numpy
+
+import commons, algorithms
+
+
+HEURISTIC = 'heuristic'
+EXHAUSTIVE = 'exhaustive'
+
+# magic, version, N, cores, mu, nu, c1, c2, number of records
+HEADER = struct.Struct('<8sIiiddddq')
+MAGIC = 'ANORPOL\0'
+VERSION = 1
+
+RECORD = numpy.dtype([('lam', '<f8'), ('m', '<i4'), ('D', '<i4'), ('U', '<i4'),
+                      ('cost', '<f8')])
+
+
+def _solve(args):
+    '''
+    Solves the model for a single arrival rate (executed by the workers)
+    '''
+    algorithm, N, cores, mu, nu, c1, c2, lam = args
+    load = commons.Load(lam, mu)
+    if algorithm == HEURISTIC:
+        sol = algorithms.Heuristic(N, nu, c1, c2, cores).heuristic(load)
+    elif algorithm == EXHAUSTIVE:
+        sol = algorithms.Exhaustive(N, nu, c1, c2).exhaustive_search(load)
+    else:
+        raise ValueError('Unknown algorithm %s' % algorithm)
+    return (lam, sol.get_m(), sol.get_d(), sol.get_u(), sol.get_cost())
+
+
+def build(path, N, cores, mu, nu, c1, c2, lambdas, algorithm=HEURISTIC, processes=None):
+    '''
+    Computes the solutions for the given arrival rates and saves them
+        * path: output file
+        * N: total number of servers (as seen by the solver)
+        * cores: number of cores per server
+        * mu: service rate
+        * nu: rate required to power on servers
+        * c1: holding cost
+        * c2: cost for servers
+        * lambdas: the arrival rates, each one smaller than N * mu
+        * algorithm: either HEURISTIC or EXHAUSTIVE
+        * processes: number of worker processes (default: all the cores)
+    '''
+    lambdas = sorted(set(float(lam) for lam in lambdas))
+    if len(lambdas) == 0:
+        raise ValueError('No arrival rates')
+    if lambdas[0] <= 0.0 or lambdas[-1] >= N * mu:
+        raise ValueError('Arrival rates must be in (0, N * mu), got [%.3f, %.3f]'
+                         % (lambdas[0], lambdas[-1]))
+
+    tasks = [(algorithm, N, cores, mu, nu, c1, c2, lam) for lam in lambdas]
+    pool = multiprocessing.Pool(processes)
+    try:
+        rows = pool.map(_solve, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    records = numpy.array(rows, dtype=RECORD)
+    with open(path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, VERSION, N, cores, mu, nu, c1, c2, len(records)))
+        records.tofile(out)
+
+
+class PolicyTable():
+    '''
+    Policy table, loaded by means of a memory map
+    '''
+
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) != HEADER.size:
+            raise ValueError('%s is not a policy table' % path)
+        magic, version, N, cores, mu, nu, c1, c2, count = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a policy table' % path)
+        self.N = N
+        self.cores = cores
+        self.mu = mu
+        self.nu = nu
+        self.costs = commons.Costs(c1, c2)
+        self.records = numpy.memmap(path, dtype=RECORD, mode='r', offset=HEADER.size,
+                                    shape=(count,))
+        # the arrival rates are small, keep them in memory for bisect
+        self.lambdas = self.records['lam'].tolist()
+
+
+    def matches(self, N, cores, mu, nu, c1, c2):
+        '''
+        Returns True if the table was computed for the given parameters
+        '''
+        return (self.N == N and self.cores == cores and self.mu == mu and self.nu == nu
+                and self.costs.c1 == c1 and self.costs.c2 == c2)
+
+
+    def lookup(self, lam):
+        '''
+        Gets the reserves for the given arrival rate: the entry of the
+        closest arrival rate in the table (the lower one, in case of ties),
+        so that the result is always a configuration chosen by the solver.
+        Arrival rates outside the table get the first/last entry.
+            * type lam: float
+            * rtype: commons.Reserves
+        '''
+        i = bisect_left(self.lambdas, lam)
+        if i == len(self.lambdas) or (i > 0 and lam - self.lambdas[i - 1] <= self.lambdas[i] - lam):
+            i -= 1
+        r = self.records[max(i, 0)]
+        return commons.Reserves(int(r['m']), int(r['D']), int(r['U']))
+
+
+    def __len__(self):
+        return len(self.lambdas)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds a policy table')
+    parser.add_argument('-N', type=int, required=True, help='Number of servers')
+    parser.add_argument('-co', type=int, required=False, default=2,
+                        help='No. of cores per server [default 2]')
+    parser.add_argument('-mu', type=float, required=False, default=4.35,
+                        help='Service rate [default 4.35]')
+    parser.add_argument('-p', type=float, required=False, default=60.0,
+                        help='Avg. # of sec. required to power up reserves [default 60]')
+    parser.add_argument('-c1', type=float, required=False, default=1.2,
+                        help='Holding cost (default 1.2)')
+    parser.add_argument('-c2', type=float, required=False, default=1.0,
+                        help='Server cost (default 1.0)')
+    parser.add_argument('-step', type=float, required=False, default=0.1,
+                        help='Spacing of the arrival rates [default 0.1]')
+    parser.add_argument('-a', required=False, default=HEURISTIC,
+                        choices=[HEURISTIC, EXHAUSTIVE], help='Algorithm [default heuristic]')
+    parser.add_argument('-j', type=int, required=False, default=None,
+                        help='No. of worker processes [default: all the cores]')
+    parser.add_argument('-o', required=True, help='Output file')
+    args = parser.parse_args()
+
+    # same parameters used by main.Monitor
+    N = args.N * args.co
+    count = int(N * args.mu / args.step)
+    lambdas = [args.step * i for i in xrange(1, count) if args.step * i < N * args.mu]
+    build(args.o, N, args.co, args.mu, 1.0 / args.p, args.c1, args.c2, lambdas,
+          args.a, args.j)
+    print 'Saved %d entries to %s' % (len(lambdas), args.o)
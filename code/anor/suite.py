@@ -0,0 +1,210 @@
+# Copyright (C) 2013 Michele Mazzucco
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Solver benchmark suite: runs the algorithms on the arrival rates of the
+traces, for several combinations of the parameters, and records wall time,
+evaluations of the cost function, peak memory and gap to the optimum
+(the solution of the exhaustive search).
+
+The results are written to a tab separated file, one row per algorithm
+and arrival rate, and summarised in a table. Each solver runs in a fresh
+worker process, so that the caches of the previous runs do not affect
+the measurements.
+'''
+
+import os
+import csv
+import random
+import argparse
+import resource
+import itertools
+import multiprocessing
+
+import commons, algorithms, cache, benchmark
+
+
+HEURISTIC = 'heuristic'
+UNIMODAL = 'unimodal'
+ANNEALING = 'annealing'
+HILL_CLIMBING = 'hillclimbing'
+EXHAUSTIVE = 'exhaustive'
+ALGORITHMS = [HEURISTIC, UNIMODAL, ANNEALING, HILL_CLIMBING, EXHAUSTIVE]
+
+TRACES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'traces')
+TRACES = [os.path.join(TRACES_DIR, 'trace_clarknet_complete.txt'),
+          os.path.join(TRACES_DIR, 'trace_clarknet_scaled.txt')]
+
+# columns of the results file
+FIELDS = ['trace', 'N', 'cores', 'nu', 'c1', 'c2', 'lam', 'algorithm', 'm', 'D', 'U',
+          'cost', 'optimum', 'gap', 'evaluations', 'elapsed', 'peak_kb']
+
+
+def create_solver(algorithm, N, nu, c1, c2, cores):
+    '''
+    Creates a solver with a private cost cache
+        * param algorithm: one of ALGORITHMS
+        * rtype: object with method solve(load), returning a commons.Result
+    '''
+    costs = cache.CostCache()
+    if algorithm == HEURISTIC:
+        return algorithms.Heuristic(N, nu, c1, c2, cores, costs)
+    elif algorithm == UNIMODAL:
+        return algorithms.Unimodal(N, nu, c1, c2)
+    elif algorithm == ANNEALING:
+        return algorithms.SimulatedAnnealing(N, nu, c1, c2, cores, costs)
+    elif algorithm == HILL_CLIMBING:
+        return algorithms.HillClimbing(N, nu, c1, c2, costs)
+    elif algorithm == EXHAUSTIVE:
+        return algorithms.Exhaustive(N, nu, c1, c2, costs)
+    raise ValueError('Unknown algorithm %s' % algorithm)
+
+
+def _run(args):
+    '''
+    Runs a solver (executed by the worker processes)
+        * rtype: tuple (m, D, U, cost, evaluations, elapsed, peak memory in KB)
+    '''
+    algorithm, N, nu, c1, c2, cores, lam, mu, seed = args
+    random.seed(seed)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = create_solver(algorithm, N, nu, c1, c2, cores).solve(commons.Load(lam, mu))
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    sol = result.solution
+    return (sol.get_m(), sol.get_d(), sol.get_u(), sol.get_cost(), result.evaluations,
+            result.elapsed, peak)
+
+
+def run(out, traces, Ns, cores, powers, c1s, c2s, mu=4.35, scale=1.5, every=10,
+        selected=ALGORITHMS, processes=1, seed=0):
+    '''
+    Runs the suite and writes the results file
+        * param out: path of the results file
+        * param traces: paths of the traces
+        * param Ns, cores, powers, c1s, c2s: the values of the number of
+          servers, number of cores per server, average time required to
+          power up a server (seconds), holding and server cost; all the
+          combinations are evaluated
+        * param scale: the arrival rates are multiplied by this factor
+        * param every: only one arrival rate out of every is used
+        * param selected: the algorithms to evaluate (the exhaustive
+          search is always run, to get the optimum)
+        * param processes: number of worker processes; more than one
+          reduces the duration of the suite but may inflate the times
+        * param seed: seed of the randomised algorithms
+        * rtype: tuple (list of rows, as dictionaries with keys FIELDS,
+          number of arrival rates skipped as too large for the capacity)
+    '''
+    configurations = []
+    skipped = 0
+    for trace in traces:
+        lambdas = sorted(set(benchmark.load_lambdas(trace, scale)))[::every]
+        for servers, co, power, c1, c2 in itertools.product(Ns, cores, powers, c1s, c2s):
+            N = servers * co # as seen by the solver, see main.Monitor
+            for lam in lambdas:
+                if lam >= N * mu:
+                    skipped += 1
+                    continue
+                configurations.append((os.path.basename(trace), N, co, 1.0 / power, c1, c2,
+                                       lam))
+
+    names = [a for a in ALGORITHMS if a in selected or a == EXHAUSTIVE]
+    tasks = [(a, N, nu, c1, c2, co, lam, mu, seed)
+             for _, N, co, nu, c1, c2, lam in configurations for a in names]
+    # a fresh process for each task, to measure its peak memory
+    pool = multiprocessing.Pool(processes, maxtasksperchild=1)
+    try:
+        results = pool.map(_run, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    rows = []
+    for i, (trace, N, co, nu, c1, c2, lam) in enumerate(configurations):
+        outcome = dict(zip(names, results[i * len(names):(i + 1) * len(names)]))
+        optimum = outcome[EXHAUSTIVE][3]
+        for a in names:
+            if a not in selected:
+                continue
+            m, D, U, cost, evaluations, elapsed, peak = outcome[a]
+            rows.append({'trace': trace, 'N': N, 'cores': co, 'nu': nu, 'c1': c1, 'c2': c2,
+                         'lam': lam, 'algorithm': a, 'm': m, 'D': D, 'U': U, 'cost': cost,
+                         'optimum': optimum, 'gap': (cost - optimum) / optimum,
+                         'evaluations': evaluations, 'elapsed': elapsed, 'peak_kb': peak})
+
+    with open(out, 'wb') as f:
+        writer = csv.DictWriter(f, FIELDS, delimiter='\t', lineterminator='\n')
+        writer.writerow(dict(zip(FIELDS, FIELDS)))
+        writer.writerows(rows)
+    return rows, skipped
+
+
+def summary(rows):
+    '''
+    Summarises the results by algorithm
+        * param rows: see run
+        * rtype: string, a table with the average and max time, average
+          evaluations, max peak memory, average and max gap to the optimum
+    '''
+    lines = ['%-13s %6s %10s %10s %12s %10s %10s %10s' % (
+        'algorithm', 'runs', 'avg sec', 'max sec', 'avg evals', 'peak KB', 'avg gap%',
+        'max gap%')]
+    for a in ALGORITHMS:
+        runs = [r for r in rows if r['algorithm'] == a]
+        if len(runs) == 0:
+            continue
+        count = float(len(runs))
+        lines.append('%-13s %6d %10.4f %10.4f %12.1f %10d %10.4f %10.4f' % (
+            a, len(runs), sum(r['elapsed'] for r in runs) / count,
+            max(r['elapsed'] for r in runs), sum(r['evaluations'] for r in runs) / count,
+            max(r['peak_kb'] for r in runs), 100.0 * sum(r['gap'] for r in runs) / count,
+            100.0 * max(r['gap'] for r in runs)))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solver benchmark suite')
+    parser.add_argument('-o', required=True, help='Results file')
+    parser.add_argument('-traces', nargs='+', required=False, default=TRACES,
+                        help='Traces [default: the clarknet traces]')
+    parser.add_argument('-N', type=int, nargs='+', required=False, default=[20],
+                        help='Numbers of servers [default 20]')
+    parser.add_argument('-co', type=int, nargs='+', required=False, default=[1, 2],
+                        help='Numbers of cores per server [default 1 2]')
+    parser.add_argument('-p', type=float, nargs='+', required=False, default=[60.0, 300.0],
+                        help='Avg. # of sec. required to power up reserves [default 60 300]')
+    parser.add_argument('-c1', type=float, nargs='+', required=False, default=[1.2],
+                        help='Holding costs [default 1.2]')
+    parser.add_argument('-c2', type=float, nargs='+', required=False, default=[1.0],
+                        help='Server costs [default 1.0]')
+    parser.add_argument('-mu', type=float, required=False, default=4.35,
+                        help='Service rate [default 4.35]')
+    parser.add_argument('-scale', type=float, required=False, default=1.5,
+                        help='Scale factor of the traces, as in main [default 1.5]')
+    parser.add_argument('-every', type=int, required=False, default=10,
+                        help='Use one arrival rate out of every [default 10]')
+    parser.add_argument('-a', nargs='+', required=False, default=ALGORITHMS,
+                        choices=ALGORITHMS, help='Algorithms [default: all]')
+    parser.add_argument('-j', type=int, required=False, default=1,
+                        help='No. of worker processes [default 1]')
+    parser.add_argument('-seed', type=int, required=False, default=0,
+                        help='Seed of the randomised algorithms [default 0]')
+    args = parser.parse_args()
+
+    rows, skipped = run(args.o, args.traces, args.N, args.co, args.p, args.c1, args.c2,
+                        args.mu, args.scale, args.every, args.a, args.j, args.seed)
+    print summary(rows)
+    print 'Saved %d rows to %s (%d arrival rates above the capacity skipped)' % (
+        len(rows), args.o, skipped)
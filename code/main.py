@@ -33,10 +33,12 @@ import monitor.commons as utils
 import monitor.haproxy_configuration as haproxy_configuration
 import monitor.stats as stats
 import monitor.socket_haproxy as socket_haproxy
-from anor.commons import Reserves, Load, Costs
+import monitor.async_haproxy as async_haproxy
+from anor.commons import Reserves, Tiers, Load, Costs
 
 import argparse
-from anor.algorithms import Heuristic
+from anor.algorithms import Heuristic, SimulatedAnnealing, WarmStart, TieredSearch
+from anor.policy import PolicyTable
 
 
 # ------------------------------------------------------------------------- #
@@ -49,6 +51,17 @@ haproxy_conf_file = "/etc/haproxy/haproxy.cfg"
 ENABLE = 'enable'
 DISABLE = 'disable'
 
+# Algorithms used to reconfigure the reserves
+HEURISTIC = 'heuristic'
+ANNEALING = 'annealing'
+WARM = 'warm' # simulated annealing, starting from the previous solution
+
+# The fields of the statistics parsed at every tick (those logged, plus the
+# ones used to decide when to power the reserves up/down)
+STAT_FIELDS = stats.HAPROXY_STAT_LOG + ['act', 'scur', 'stot']
+# The statistics of the backend only, see sec. 9.2 of the HAProxy documentation
+STAT_FILTER = (-1, 2, -1)
+
 
 # Amazon EC2 credentials
 aws_access_key_id = 'your key id here'
@@ -91,6 +104,18 @@ def load_lambdas(path):
     return lines
 
 
+def server_commands(enable, ids):
+    '''
+    Commands that enable/disable the given servers of the backend
+     * type enable: string (either 'enable' or 'disable')
+     * type ids: list of strings, the instance ids
+     * rtype: list of strings
+    (the servers could be drained instead, with 'set weight www/<id> 0%'
+    and restored with 100%)
+    '''
+    return ['%s server www/%s' % (enable, i) for i in ids]
+
+
 class ArrRate():
     '''
     Object used to monitor the arrival rate. It is used ONLY when reconfiguring
@@ -119,12 +144,14 @@ class ArrRate():
 class Monitor():
     '''
     Class used to control servers on Amazon EC2 cloud. The reserves block
-    is 'powered' up/down by means of a TAG.
+    is 'powered' up/down by means of a TAG. The reserves can be split into
+    tiers (see anor.commons.Tiers), each one powered up/down independently.
     '''
 
 
     def __init__(self, reserves, costs, mu, cores, power_up_time, monitor_interval, 
-                 reconf_interval, lambdas_path, enable_tresholds):
+                 reconf_interval, lambdas_path, enable_tresholds, policy_path=None,
+                 solver=HEURISTIC, solver_budget=0.5, tiers=1):
         '''
         Initializes the class. Then it fetches the details of the 
         `ALWAYS-ON' servers from Amazon EC2, updates the configuration of
@@ -150,7 +177,34 @@ class Monitor():
             parameters? Default 300 seconds. If 0, ne reconfiguration occurs
         * type enable_tresholds: boolean
         * param enable_tresholds: enable D and U? [deafult True]
+        * type policy_path: string
+        * param policy_path: policy table (see anor.policy) used to reconfigure
+            the reserves. If None, the model is solved at each reconfiguration
+        * type solver: string
+        * param solver: algorithm used at each reconfiguration, either
+            HEURISTIC, ANNEALING or WARM; only HEURISTIC (the default) with
+            more than one tier [default HEURISTIC]
+        * type solver_budget: float
+        * param solver_budget: max time (in seconds) the solver can take
+            [default 0.5]
+        * type tiers: int
+        * param tiers: max number of tiers of reserves; if greater than 1,
+            the reserves are split into tiers with the same thresholds, and
+            the reconfigurations use anor.algorithms.TieredSearch [default 1]
         '''
+        if solver not in [HEURISTIC, ANNEALING, WARM]:
+            raise ValueError('Unknown solver %s' % solver)
+        if tiers < 1:
+            raise ValueError('At least one tier is required: %d' % tiers)
+        if tiers > 1 and policy_path is not None:
+            raise ValueError('Policy tables support a single tier of reserves')
+        if tiers > 1 and solver != HEURISTIC:
+            raise ValueError('The tiers of reserves are optimized by TieredSearch, '
+                             'solver %s not supported' % solver)
+        self.tiers = tiers
+        self.solver = solver
+        self.solver_budget = solver_budget
+        self.__solver = None # created at the first reconfiguration
         self.costs = costs # holding cost and cost for servers
         self.mu = mu
         self.monitor_interval = monitor_interval
@@ -162,7 +216,7 @@ class Monitor():
         
         self.all_stats = stats.All(costs)
         self.__power_up_time = power_up_time # in seconds, float
-        self.res = reserves
+        self.res = Tiers.split(reserves, tiers)
             
         self.servers = utils.InstanceList()
         self.__init_list()
@@ -171,7 +225,8 @@ class Monitor():
         # adds ALL the servers to the configuration file, and reloads HAProxy
         self.__reload_haproxy()
         
-        self.__res_state = OFF # status of the reserves
+        self.__res_state = [OFF] * len(self.res) # status of each tier
+        self.__power_up_at = {} # tier -> time when it will be powered up
         
         self.__go = True # guard used in the for loop
         signal.signal(signal.SIGTERM, self.do_exit)
@@ -179,6 +234,9 @@ class Monitor():
         
         self.socket = socket_haproxy.sock()
         self.data = None # data attached to the socket        
+        # non-blocking client, used to get the statistics at every tick
+        self.client = async_haproxy.AsyncClient()
+        self.__parse_stat = socket_haproxy.StatParser(STAT_FIELDS).parse
         self.arr_rate = ArrRate()
         
         # No. of reconfigurations
@@ -196,6 +254,14 @@ class Monitor():
             #self.lambdas = self.lambdas[243:277] # take 10 extra hours
             self.lambdas[:] = [x * 1.5 for x in self.lambdas] # scale up the load by 50%
             
+        self.policy = None
+        if policy_path is not None:
+            self.policy = PolicyTable(policy_path)
+            if not self.policy.matches(self.N * self.cores, self.cores, self.mu,
+                                       1.0 / self.__power_up_time, costs.c1, costs.c2):
+                raise ValueError('Policy table %s computed for different parameters' % policy_path)
+            log.info('Using policy table %s, %d entries' % (policy_path, len(self.policy)))
+            
         
     
     def do_exit(self, sig, stack):
@@ -234,18 +300,38 @@ class Monitor():
                 tmp = instances[i]
                 log.info("Adding %s, IP %s to always on", tmp.id, tmp.ip_address)
                 self.servers.add(utils.Instance(tmp, utils.ALWAYS_ON))
+            self.__assign_tiers()
                 
         del conn
         
         
+    def __assign_tiers(self):
+        '''
+        Assigns the reserves to the tiers, in order
+        '''
+        tier = 0
+        count = 0
+        for i in self.servers.values():
+            if i.state != utils.RESERVE:
+                i.tier = None
+                continue
+            while tier < len(self.res) and count == self.res[tier].m:
+                tier += 1
+                count = 0
+            i.tier = tier
+            count += 1
+        
+        
    
-    def enable_disable_reserves_haproxy(self, enable=ENABLE):
+    def enable_disable_reserves_haproxy(self, enable=ENABLE, tier=None):
         '''
         Enables/disables reserves the servers
          * type servers_list: list of strings
          * param enable: either 'enable' or 'disable', or a ValueError will be
                          raised
          * type enable: string (either 'enable' or 'disable')
+         * type tier: int
+         * param tier: the tier of reserves [default None, all the tiers]
          * rtype: void
         '''
         # If it keeps making troubles,
@@ -254,28 +340,34 @@ class Monitor():
         if enable not in ['enable', 'disable']:
             raise ValueError('Expecting either enable or disable, got %s' % enable)
        
-        #weight = 100
-        #if enable == DISABLE:
-        #    weight = 0
-       
-        #l = []
-        for i in self.servers.values():
-            if i.state == utils.RESERVE:
-                command = '%s server www/%s' % (enable, i.instance_id)
-                #tmp = 'set weight www/%s %d%%' % (i, weight)
-                #l.append(tmp)
-                try:        
-                    self.data.socket.send(command)
-                    self.data.socket.wait()
-                    
-                    if log.isEnabledFor(logging.DEBUG):
-                        log.debug(command)
-                except SocketError, e:
-                    log.error('socket error, unable to enable/disable servers: %s' % e)
-                    self.data.reconnect()
-                
-                
-        #command = ';'.join(l)
+        # the whole block is switched in one round trip
+        ids = [i.instance_id for i in self.servers.values()
+               if i.state == utils.RESERVE and (tier is None or i.tier == tier)]
+        self.__execute(server_commands(enable, ids))
+        
+        
+    def __execute(self, commands):
+        '''
+        Runs the given commands in one round trip, see
+        socket_haproxy.sock.execute, and logs the ones that failed
+         * type commands: list of strings
+         * rtype: boolean, True if all the commands succeeded
+        '''
+        try:
+            results = self.data.socket.execute(commands)
+        except SocketError, e:
+            log.error('socket error, unable to enable/disable servers: %s' % e)
+            self.data.reconnect()
+            return False
+        
+        success = True
+        for command, result in zip(commands, results):
+            if len(result) > 0:
+                log.error('%s: %s' % (command, result))
+                success = False
+            elif log.isEnabledFor(logging.DEBUG):
+                log.debug(command)
+        return success
         
         
         
@@ -343,7 +435,7 @@ class Monitor():
                 log.warn('Recreating UNIX socket')
                 try:
                     self.socket = socket_haproxy.sock()
-                    self.data = socket_haproxy.SocketData(self.socket) # socket_path is used to reconnect
+                    self.data = socket_haproxy.SocketData(self.socket, fields=STAT_FIELDS) # socket_path is used to reconnect
                     # the 2 means BACKEND, see documentation (sec. 9.2)
                     filter_backend = ['-1 2 -1']
                     self.data.register_stat_filter(filter_backend)
@@ -371,40 +463,8 @@ class Monitor():
 #            weight = 0
         
         log.warn('Recovery')
-        l = []
-        for i in always_on:
-            tmp = 'enable server www/%s' % i
-            #tmp = 'set weight www/%s 100%%' % (i)
-            l.append(tmp)
-     
-        command = ';'.join(l)
-        try:        
-            self.data.socket.send(command)
-            self.data.socket.wait()
-            
-            if log.isEnabledFor(logging.DEBUG):
-                log.debug(command)
-        except SocketError, e:
-            log.error('socket error, unable to enable always on servers: %s' % e)
-            self.data.reconnect()
-
-        del l        
-        l = []
-        for i in reserves:
-            tmp = '%s server www/%s' % (enable_disable_reserves, i)
-            #tmp = 'set weight www/%s %d%%' % (i, weight)
-            l.append(tmp)
-        command = ';'.join(l)
-        try:        
-            self.data.socket.send(command)
-            self.data.socket.wait()
-            
-            if log.isEnabledFor(logging.DEBUG):
-                log.debug(command)
-        except SocketError, e:
-            log.error('socket error, unable to enable/disable reserves: %s' % e)
-            self.data.reconnect()
-            
+        self.__execute(server_commands(ENABLE, always_on) +
+                       server_commands(enable_disable_reserves, reserves))
             
         self.data.update_stat()
         backend = self.data.stat[2]["BACKEND"]
@@ -416,7 +476,7 @@ class Monitor():
             expected += len(reserves)
         
         if active_servers != expected:
-            msg = "[Recovery] Expected %d active servers, have %d. Command: %s" % (expected, active_servers, command)
+            msg = "[Recovery] Expected %d active servers, have %d. Reserves: %s" % (expected, active_servers, enable_disable_reserves)
             log.fatal(msg)
             sys.exit(1)
             
@@ -428,48 +488,85 @@ class Monitor():
         '''
         self.enable_disable_reserves_haproxy('disable')
         self.set_res_state(OFF)
+        self.__power_up_at.clear()
+        self.__set_alarm()
+        
+        
+    def __power_up(self, tier, delay):
+        '''
+        Starts powering up a tier of reserves, that will be enabled after
+        delay seconds (unless the number of jobs drops to its D)
+        '''
+        self.set_res_state(POWERING_ON, tier)
+        self.__power_up_at[tier] = time.time() + delay
+        self.__set_alarm()
+        
+        
+    def __set_alarm(self):
+        '''
+        Sets the alarm for the first tier that completes its power up
+        '''
+        if len(self.__power_up_at) == 0:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            return
+        delay = min(self.__power_up_at.values()) - time.time()
+        signal.signal(signal.SIGALRM, self.__enable_reserves)
+        signal.setitimer(signal.ITIMER_REAL, max(delay, 0.001))
             
     
     # handler for SIGALRM signals
     def __enable_reserves(self, signum, stack):
         '''
-        Enables the reserves, see 9.2
-        http://haproxy.1wt.eu/download/1.4/doc/configuration.txt
+        Enables the tiers of reserves that have completed their power up,
+        see 9.2 http://haproxy.1wt.eu/download/1.4/doc/configuration.txt
         '''
-        
-        if self.res.m > 0:
+        now = time.time()
+        ready = [k for k, t in self.__power_up_at.items() if t <= now]
+        if len(ready) > 0:
             self.data.update_stat()
             backend = self.data.stat[2]["BACKEND"]
             # current number of jobs inside the system (waiting or being executed)
             scur = backend['scur']
-            if scur <= self.res.D:                
-                self.set_res_state(OFF) # set the state of reserves to OFF
-                log.info('scur %d, switched state from POWERING_ON to OFF' % scur)
-            else:                    
-                self.enable_disable_reserves_haproxy()
-                self.set_res_state(ON)
-                log.info('scur %d, switched state from POWERING_ON to ON' % scur)
+            for k in ready:
+                del self.__power_up_at[k]
+                if scur <= self.res[k].D:
+                    self.set_res_state(OFF, k) # set the state of the tier to OFF
+                    log.info('scur %d, switched state of tier %d from POWERING_ON to OFF'
+                             % (scur, k))
+                else:
+                    self.enable_disable_reserves_haproxy(ENABLE, k)
+                    self.set_res_state(ON, k)
+                    log.info('scur %d, switched state of tier %d from POWERING_ON to ON'
+                             % (scur, k))
+        self.__set_alarm()
             
         
         
-    def get_res_state(self):
+    def get_res_state(self, tier=0):
         '''
-        Gets the state of the reserves
+        Gets the state of a tier of reserves
+        :type tier: int
+        :param tier: the tier [default 0, the first one]
         :rtype: string (ON, OFF, POWERING_ON)
         '''
-        return self.__res_state
+        return self.__res_state[tier]
         
         
-    def set_res_state(self, new_state):
+    def set_res_state(self, new_state, tier=None):
         '''
         Sets the state of the reserves to the specified state
         :type new_state: string
         :param new_state: ON, OFF, or POWERING_ON
+        :type tier: int
+        :param tier: the tier [default None, all the tiers]
         '''
         if new_state not in [ON, OFF, POWERING_ON]:
             raise ValueError('The state should be either ON, OFF, or POWERING_ON')
         
-        self.__res_state = new_state
+        if tier is None:
+            self.__res_state = [new_state] * len(self.res)
+        else:
+            self.__res_state[tier] = new_state
     
     
     def sleep(self, sleep_time=None):
@@ -481,6 +578,50 @@ class Monitor():
             self.__go = False
             log.info('Keyboard interrupt')
             
+            
+    def wait(self, sleep_time):
+        '''
+        Sleeps for the given time, while the non-blocking client performs
+        the I/O of the pending commands
+        '''
+        until = time.time() + sleep_time
+        try:
+            while self.__go:
+                left = until - time.time()
+                if left <= 0.0:
+                    break
+                self.client.poll(left)
+        except KeyboardInterrupt: # CTRL+D
+            self.__go = False
+            log.info('Keyboard interrupt')
+            
+            
+    def update_stat(self, sample=None):
+        '''
+        Gets the statistics of the backend (self.data.stat) through the
+        non-blocking client, calling sample (if not None) while the answer
+        is on the way. If the client does not get the answer, they are read
+        from the blocking socket, as before.
+        '''
+        request = self.client.show_stat(STAT_FILTER, self.__parse_stat)
+        if sample is not None:
+            sample()
+        if self.client.wait(request, socket_haproxy.HAPROXY_CLI_CMD_TIMEOUT) and \
+                request.error is None and request.result[1] > 0:
+            self.data.stat, self.data.pxcount, self.data.svcount = request.result
+            return
+        log.warn('show stat failed on the non-blocking client: %s' %
+                 (request.error if request.done else 'no answer'))
+        # drops the pending commands
+        self.client.close()
+        self.client = async_haproxy.AsyncClient(self.client.path)
+        try:
+            self.data.update_stat()
+        except RuntimeError, e:
+            log.error(e)
+            self.data.reconnect()
+            self.data.update_stat()
+            
 
                 
     def change_allocation(self):
@@ -505,21 +646,47 @@ class Monitor():
             #self.worker_process = Thread(name='reconfigure', target=self.worker, args=(lam,))
             #self.worker_process.setDaemon(True)
             #self.worker_process.start()
-            nu = 1.0 / self.__power_up_time
-            load = Load(lam, self.mu)
-            heuristic = Heuristic(self.N * self.cores, nu, self.costs.c1, self.costs.c2, self.cores)
-            solution = heuristic.heuristic(load)
-            new_reserves = solution.reserves
-            new_reserves.m /= self.cores               
-            
-            log.info('Current configuration, %s, new solution: %s' 
-                     % (self.res.__str__(), solution.__str__()))            
+            if self.policy is not None:
+                tmp = self.policy.lookup(lam)
+                new_reserves = Tiers.split(Reserves(tmp.m / self.cores, tmp.D, tmp.U), 1)
+                log.info('Current configuration, %s, new solution (policy table): %s'
+                         % (self.res.__str__(), tmp.__str__()))
+            else:
+                nu = 1.0 / self.__power_up_time
+                load = Load(lam, self.mu)
+                if self.__solver is None:
+                    # the same object is used across epochs (WARM keeps the last solution)
+                    if self.tiers > 1:
+                        self.__solver = TieredSearch(self.N * self.cores, nu, self.costs.c1,
+                                                     self.costs.c2, self.tiers, self.cores)
+                    else:
+                        if self.solver == ANNEALING:
+                            cls = SimulatedAnnealing
+                        elif self.solver == WARM:
+                            cls = WarmStart
+                        else:
+                            cls = Heuristic
+                        self.__solver = cls(self.N * self.cores, nu, self.costs.c1, self.costs.c2, self.cores)
+                # the solver must not delay the next monitoring tick
+                result = self.__solver.solve(load, deadline=time.time() + self.solver_budget)
+                solution = result.solution
+                # the solvers count the cores, the monitor counts the servers
+                if isinstance(solution.reserves, Tiers):
+                    new_reserves = Tiers([Reserves(t.m / self.cores, t.D, t.U)
+                                          for t in solution.reserves])
+                else:
+                    new_reserves = Tiers.split(Reserves(solution.get_m() / self.cores,
+                                                        solution.get_d(), solution.get_u()), 1)
+                
+                log.info('Current configuration, %s, new solution: %s' 
+                         % (self.res.__str__(), result.__str__()))            
 
-            diff = self.res.m - new_reserves.m
-            if diff == 0:
+            if new_reserves == self.res:
                 log.info("Nothing to do, old reserve parameters equal to the new ones")
                 return
             
+            diff = self.res.m - new_reserves.m
+            
             always_on = []
             reserves = []
             if diff > 0: # move some reserves to always_on
@@ -544,14 +711,25 @@ class Monitor():
                     else:
                         always_on.append(i.instance_id)
                         
+            # the tresholds might have changed, as well as the tiers; the
+            # tiers keep their state, the new ones are off
+            count = len(new_reserves)
+            self.__res_state = (self.__res_state + [OFF] * count)[:count]
+            for k in self.__power_up_at.keys():
+                if k >= count:
+                    del self.__power_up_at[k]
+            self.__set_alarm()
+            self.res = new_reserves
+            self.__assign_tiers()
+            
             # fix the servers that have been moved
-            if self.__res_state == ON:
+            enabled = [i.instance_id for i in self.servers.values()
+                       if i.state == utils.RESERVE and self.__res_state[i.tier] == ON]
+            disabled = [i for i in reserves if i not in enabled]
+            if len(disabled) == 0:
                 self.__recovery(always_on, reserves, 'enable')
             else:
-                self.__recovery(always_on, reserves, 'disable')
-            
-            # the tresholds might have changed
-            self.res = new_reserves
+                self.__recovery(always_on + enabled, disabled, 'disable')
 
     
    
@@ -571,7 +749,7 @@ class Monitor():
             pid_file.write('%d\n' % pid)
         
         try:
-            self.data = socket_haproxy.SocketData(self.socket) # socket_path is used to reconnect
+            self.data = socket_haproxy.SocketData(self.socket, fields=STAT_FIELDS) # socket_path is used to reconnect
             # the 2 means BACKEND, see documentation (sec. 9.2)
             filter_backend = ['-1 2 -1'] 
             self.data.register_stat_filter(filter_backend)
@@ -600,13 +778,8 @@ class Monitor():
             while self.__go:              
                 cur_time = time.time() # get current time
                 
-                # update stats
-                try:
-                    self.data.update_stat()
-                except RuntimeError, e:
-                    log.error(e)
-                    self.data.reconnect()
-                    self.data.update_stat()
+                # update stats, sampling the hardware in the meantime
+                self.update_stat(lambda: self.all_stats.update_hw(cur_time))
                     
                 stat = self.data.stat;
                 backend = stat[2]["BACKEND"] # dictionary, 2 is the key (see filter_backend)
@@ -628,15 +801,15 @@ class Monitor():
                 # how about using 'req_rate' from HAProxy instead?
                 
                 
-                self.all_stats.update_hw(cur_time)
                 # haproxy stats
                 self.all_stats.update_haproxy(backend, cur_time)
                 
                 # deal with reserves
                 powered_on_servers = active_servers
-                if self.get_res_state() == POWERING_ON:
-                    # reserves being powered on consume power
-                    powered_on_servers = self.N # always on + reserves
+                for k, tier in enumerate(self.res):
+                    if self.get_res_state(k) == POWERING_ON:
+                        # reserves being powered on consume power
+                        powered_on_servers += tier.m
                 
                 # update cost
                 self.all_stats.update_cost(scur, powered_on_servers * self.cores, 
@@ -654,26 +827,25 @@ class Monitor():
                 # check no. of jobs in the system and enable/disable
                 # reserves, if necessary
                 if self.enable_tresholds == True:
-                    if scur > self.res.U and self.res.m > 0 and self.get_res_state() == OFF:
+                    for k, tier in enumerate(self.res):
+                        if scur > tier.U and self.get_res_state(k) == OFF:
+                            
+                            power_up_delay = utils.exp_deviate(self.__power_up_time)
+                            log.info("scur = %d, enabling tier %d in %.2f sec." 
+                                     % (scur, k, power_up_delay))
+                            self.__power_up(k, power_up_delay)
                         
-                        power_up_delay = utils.exp_deviate(self.__power_up_time)
-                        log.info("scur = %d, enabling reserves in %.2f sec." % (scur, power_up_delay))
-                        self.set_res_state(POWERING_ON)
-                        
-                        # set alarm
-                        signal.signal(signal.SIGALRM, self.__enable_reserves)
-                        signal.setitimer(signal.ITIMER_REAL, power_up_delay)
-                    
-                    elif scur <= self.res.D and self.res.m > 0 and self.get_res_state() == ON:
-                        log.info('scur %d, disabling reserves' % scur)
-                        self.__disable_reserves()                    
+                        elif scur <= tier.D and self.get_res_state(k) == ON:
+                            log.info('scur %d, disabling tier %d' % (scur, k))
+                            self.enable_disable_reserves_haproxy(DISABLE, k)
+                            self.set_res_state(OFF, k)
                     
                 last_check = cur_time # update the time when the last check was made   
                 
                 # wait before the new cycle 
                 sleep_interval = self.monitor_interval - (time.time() - cur_time)
                 if sleep_interval > 0.0:
-                    self.sleep(sleep_interval)                    
+                    self.wait(sleep_interval)                    
         except SocketError, e:
             log.error('socket error: %s' % e)
             sys.exit(1)
@@ -682,6 +854,7 @@ class Monitor():
         #    raise e
         finally:
             self.socket.close() # close socket
+            self.client.close()
             self.all_stats.close_all() # close files attached to the statistics
                 
             log.info("Total cost %.3f, avg. %3f" % 
@@ -759,6 +932,14 @@ if __name__ == '__main__':
                         help = "file with load trace")
     parser.add_argument('-t', required=False, default='True',
                         help = 'Enable tresholds? [Default True, applies only if -r > 0]')
+    parser.add_argument('-a', required=False, default=HEURISTIC, choices=[HEURISTIC, ANNEALING, WARM],
+                        help = 'Algorithm used to reconfigure the reserves, only with -k 1 [Default heuristic]')
+    parser.add_argument('-b', type=float, required=False, default=0.5,
+                        help = 'Max time (in seconds) spent by the algorithm at each reconfiguration [Default 0.5]')
+    parser.add_argument('-pt', required=False, default=None,
+                        help = 'Policy table, see anor/policy.py [Default None, solve at each reconfiguration]')
+    parser.add_argument('-k', type=int, required=False, default=1,
+                        help = 'Max number of tiers of reserves, powered up/down independently [Default 1]')
     args = parser.parse_args()
     
     if args.r == 0.0:
@@ -780,6 +961,6 @@ if __name__ == '__main__':
     costs = Costs(args.c1, args.c2)
     reserves = Reserves(args.m, args.D, args.U)
     monitor = Monitor(reserves, costs, args.mu, args.co, args.p, args.mon, 
-                      args.r, args.o, tresholds_enabled)
+                      args.r, args.o, tresholds_enabled, args.pt, args.a, args.b, args.k)
     monitor.monitor_haproxy()
        
@@ -0,0 +1,363 @@
+# Copyright (C) 2013 Michele Mazzucco
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Non-blocking client of the HAProxy stats socket: the commands are queued
+and the I/O is performed by AsyncClient.poll, which waits at most the given
+time, so that the socket does not stall the rest of the monitor (sampling,
+reconfiguration). Same commands and prompt mode as socket_haproxy.sock.
+
+main.Monitor reads the statistics of every tick through it, sampling the
+hardware while the answer is on the way; the blocking
+socket_haproxy.SocketData is the fallback, and still sends the commands
+that change the servers.
+'''
+
+import time
+import errno
+import select
+import socket
+import logging
+from collections import deque
+from socket import error as SocketError
+
+from socket_haproxy import SOCKET_PATH, HAPROXY_CLI_TIMEOUT, HAPROXY_CLI_CMD_TIMEOUT, \
+    HAPROXY_CLI_CMD_SEP, HAPROXY_CLI_RESULT_END, HAPROXY_CLI_RBUF_SIZE, parse_stat, parse_info
+
+
+# Seconds between two connection attempts
+HAPROXY_ASYNC_RETRY = 1.0
+# Number of times a command is sent (i.e., retried after the connection is lost)
+HAPROXY_ASYNC_MAX_ATTEMPTS = 3
+
+
+class Request:
+    '''
+    A command sent to HAProxy. Once done, either result (the output,
+    parsed) or error (an exception) is set and the callback, if any, is
+    invoked with the request.
+    '''
+    def __init__(self, cmdline, parse=None, callback=None):
+        '''
+        * cmdline: the command
+        * parse: function converting the output (a list of lines) into the
+          result; if None, the result is the list of lines
+        * callback: function invoked with the request once done
+        '''
+        if '\n' in cmdline or HAPROXY_CLI_CMD_SEP in cmdline:
+            raise ValueError('one command expected, got: %s' % cmdline)
+        self.cmdline = cmdline
+        self.parse = parse
+        self.callback = callback
+        self.attempts = 0
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+    def complete(self, lines=None, error=None):
+        '''
+        Completes the request, with the output (or the error)
+        '''
+        if error is None:
+            try:
+                self.result = lines if self.parse is None else self.parse(lines)
+            except Exception, e:
+                error = e
+        self.error = error
+        self.done = True
+        if self.callback is not None:
+            self.callback(self)
+
+
+    def __str__(self):
+        return self.cmdline
+
+
+def _check_empty(lines):
+    # the commands changing the servers print nothing on success
+    output = '\n'.join(lines).strip()
+    if output:
+        raise RuntimeError(output)
+    return True
+
+
+class AsyncClient:
+    '''
+    Non-blocking client of the HAProxy stats socket, in prompt mode. The
+    commands are pipelined: they are written as soon as the socket is
+    writable, and their outputs (each one ending with the prompt) are
+    matched to them in order. If the connection is lost, or a command does
+    not answer within the timeout, the client reconnects and sends again
+    the commands not completed (all of them can be repeated), at most
+    HAPROXY_ASYNC_MAX_ATTEMPTS times.
+    '''
+    def __init__(self, path=SOCKET_PATH, timeout=HAPROXY_CLI_CMD_TIMEOUT,
+                 retry=HAPROXY_ASYNC_RETRY):
+        '''
+        * path: path of the UNIX socket
+        * timeout: seconds without output after which the connection is
+          considered lost
+        * retry: seconds between two connection attempts
+        '''
+        self.path = path
+        self.timeout = timeout
+        self.retry = retry
+        self._socket = None
+        self._queue = deque() # requests to send
+        self._sent = deque() # requests sent, waiting for their output
+        self._wbuf = bytearray()
+        self._rbuf = bytearray(HAPROXY_CLI_RBUF_SIZE)
+        self._end = 0 # received data is _rbuf[:_end]
+        self._connect_at = 0.0
+        self._last_io = 0.0
+
+
+    def fileno(self):
+        '''
+        Gets the file descriptor of the socket (-1 if not connected), e.g.,
+        to wait on it together with other files
+        '''
+        return -1 if self._socket is None else self._socket.fileno()
+
+
+    def is_connected(self):
+        return self._socket is not None
+
+
+    def pending(self):
+        '''
+        Gets the number of requests not completed yet
+        '''
+        return len(self._queue) + len(self._sent)
+
+
+    def connect(self):
+        '''
+        Connects the socket (connections to UNIX sockets do not block) and
+        enters the prompt mode
+            * raises SocketError if HAProxy cannot be reached
+        '''
+        self.close()
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(self.path)
+        except SocketError:
+            s.close()
+            raise
+        s.setblocking(0)
+        self._socket = s
+        self._last_io = time.time()
+        # before any other command
+        self._queue.extendleft([Request('set timeout cli %d' % HAPROXY_CLI_TIMEOUT),
+                                Request('prompt')])
+        self.__flush_queue()
+
+
+    def close(self):
+        '''
+        Closes the socket; the requests not completed are kept, and sent
+        again once connected
+        '''
+        if self._socket is None:
+            return
+        try:
+            self._socket.close()
+        except SocketError:
+            pass # ignore
+        self._socket = None
+        self._wbuf = bytearray()
+        self._end = 0
+        # the requests sent are sent again, if they can be retried
+        for request in reversed(self._sent):
+            if request.attempts < HAPROXY_ASYNC_MAX_ATTEMPTS:
+                self._queue.appendleft(request)
+            else:
+                request.complete(error=SocketError('connection lost: %s' % request))
+        self._sent.clear()
+        # prompt mode is entered again by connect
+        self._queue = deque(r for r in self._queue
+                            if r.cmdline != 'prompt' and not r.cmdline.startswith('set timeout cli'))
+
+
+    def command(self, cmdline, parse=None, callback=None):
+        '''
+        Queues a command
+            * see Request
+            * rtype: Request
+        '''
+        request = Request(cmdline, parse, callback)
+        self._queue.append(request)
+        self.__flush_queue()
+        return request
+
+
+    def show_stat(self, stat_filter=None, parse=parse_stat, callback=None):
+        '''
+        Queues a 'show stat'
+            * param stat_filter: None, or tuple (iid, type, sid), see
+              socket_haproxy.SocketData.register_stat_filter
+            * param parse: see socket_haproxy.parse_stat and StatParser.parse
+            * rtype: Request, whose result is (pxstat, pxcount, svcount)
+        '''
+        cmdline = 'show stat'
+        if stat_filter is not None:
+            cmdline = 'show stat %d %d %d' % stat_filter
+        return self.command(cmdline, parse, callback)
+
+
+    def show_info(self, callback=None):
+        '''
+        Queues a 'show info'
+            * rtype: Request, whose result is a dictionary, see
+              socket_haproxy.parse_info
+        '''
+        return self.command('show info', parse_info, callback)
+
+
+    def enable_server(self, backend, server, callback=None):
+        return self.command('enable server %s/%s' % (backend, server), _check_empty, callback)
+
+
+    def disable_server(self, backend, server, callback=None):
+        return self.command('disable server %s/%s' % (backend, server), _check_empty, callback)
+
+
+    def set_weight(self, backend, server, weight, callback=None):
+        '''
+        * weight: integer, or string (e.g., '50%')
+        '''
+        return self.command('set weight %s/%s %s' % (backend, server, weight), _check_empty,
+                            callback)
+
+
+    def poll(self, timeout=0.0):
+        '''
+        Performs the I/O that is ready, waiting at most timeout seconds, and
+        completes the requests whose output has been received
+            * rtype: list of the requests completed
+        '''
+        now = time.time()
+        if self._socket is None:
+            if self.pending() == 0:
+                time.sleep(timeout) # nothing to do
+                return []
+            if now < self._connect_at:
+                time.sleep(min(timeout, self._connect_at - now))
+                return []
+            try:
+                self.connect()
+            except SocketError, e:
+                logging.warn('unable to connect to %s: %s' % (self.path, e))
+                self._connect_at = now + self.retry
+                return []
+
+        wlist = [self._socket] if len(self._wbuf) > 0 else []
+        try:
+            readable, writable, _ = select.select([self._socket], wlist, [], timeout)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return [] # e.g., SIGALRM, see main.Monitor
+            raise
+
+        completed = []
+        try:
+            if writable:
+                self.__write()
+            if readable:
+                completed = self.__read()
+        except SocketError, e:
+            logging.warn('connection to %s lost: %s' % (self.path, e))
+            self.__reconnect_later()
+            return completed
+
+        if len(self._sent) > 0 and time.time() - self._last_io > self.timeout:
+            logging.warn('no answer from %s in %.1f sec., reconnecting' % (self.path, self.timeout))
+            self.__reconnect_later()
+        return completed
+
+
+    def wait(self, request, timeout=None):
+        '''
+        Performs the I/O until the request is completed
+            * param timeout: seconds, None means no limit
+            * rtype: boolean, True if the request has been completed
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        while not request.done:
+            left = self.retry if deadline is None else deadline - time.time()
+            if left <= 0:
+                break
+            self.poll(min(left, self.retry))
+        return request.done
+
+
+    def __reconnect_later(self):
+        self.close()
+        self._connect_at = time.time()
+
+
+    def __flush_queue(self):
+        # the queued requests are written as soon as the socket is writable
+        if self._socket is None:
+            return
+        while len(self._queue) > 0:
+            request = self._queue.popleft()
+            request.attempts += 1
+            self._wbuf.extend(request.cmdline + '\n')
+            self._sent.append(request)
+
+
+    def __write(self):
+        count = self._socket.send(self._wbuf)
+        del self._wbuf[:count]
+        self._last_io = time.time()
+
+
+    def __read(self):
+        buf = self._rbuf
+        if self._end == len(buf):
+            buf.extend(bytearray(len(buf)))
+        view = memoryview(buf)
+        try:
+            count = self._socket.recv_into(view[self._end:])
+        except SocketError, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            raise
+        finally:
+            del view
+        if count == 0:
+            raise SocketError('connection closed')
+        self._last_io = time.time()
+        # the end of a result cannot be in the data already scanned
+        start = max(0, self._end - len(HAPROXY_CLI_RESULT_END) + 1)
+        self._end += count
+
+        completed = []
+        begin = 0 # beginning of the output of the first request sent
+        while len(self._sent) > 0:
+            idx = buf.find(HAPROXY_CLI_RESULT_END, start, self._end)
+            if idx < 0:
+                break
+            request = self._sent.popleft()
+            request.complete(str(buf[begin:idx]).strip('\n').split('\n'))
+            completed.append(request)
+            begin = start = idx + len(HAPROXY_CLI_RESULT_END)
+        if begin > 0:
+            del buf[:begin]
+            buf.extend(bytearray(begin)) # keep the size
+            self._end -= begin
+        return completed
@@ -0,0 +1,237 @@
+# Copyright (C) 2013 Michele Mazzucco
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Benchmarks of the parsing of the HAProxy statistics, on synthetic 'show
+stat' output, and of the receive path of socket_haproxy.sock, against a
+fake HAProxy stats socket.
+'''
+
+import os
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+from collections import deque
+
+import socket_haproxy
+from socket_haproxy import HAPROXY_STAT_CSV, HAPROXY_STAT_SEP, HAPROXY_STAT_COMMENT, \
+    HAPROXY_CLI_PROMPT, HAPROXY_CLI_MAXLINES
+
+
+def synthetic_stat(servers, proxies=1, seed=0):
+    '''
+    Generates the output of 'show stat' for the given number of servers,
+    spread over the proxies (each one with a frontend and a backend)
+        * rtype: list of lines, without the line terminators
+    '''
+    rnd = random.Random(seed)
+    lines = [HAPROXY_STAT_COMMENT + ' ' + HAPROXY_STAT_SEP.join(
+        field for _, (_, field) in HAPROXY_STAT_CSV) + HAPROXY_STAT_SEP]
+
+    def row(pxname, svname, iid, sid, stype):
+        values = []
+        for _, (field_type, field) in HAPROXY_STAT_CSV:
+            if field == 'pxname':
+                values.append(pxname)
+            elif field == 'svname':
+                values.append(svname)
+            elif field == 'iid':
+                values.append(str(iid))
+            elif field == 'sid':
+                values.append(str(sid))
+            elif field == 'type':
+                values.append(str(stype))
+            elif field == 'status':
+                values.append('UP' if stype == 2 else 'OPEN')
+            elif field_type is int:
+                # some fields are empty, as in the real output
+                values.append('' if rnd.random() < 0.2 else str(rnd.randint(0, 100000)))
+            else:
+                values.append('')
+        return HAPROXY_STAT_SEP.join(values) + HAPROXY_STAT_SEP
+
+    for p in xrange(proxies):
+        pxname = 'proxy%d' % p
+        iid = p + 1
+        lines.append(row(pxname, 'FRONTEND', iid, 0, 0))
+        count = servers / proxies + (1 if p < servers % proxies else 0)
+        for s in xrange(count):
+            lines.append(row(pxname, 'server%d' % s, iid, s + 1, 2))
+        lines.append(row(pxname, 'BACKEND', iid, 0, 1))
+    return lines
+
+
+def parse_rate(parse, lines, duration=1.0):
+    '''
+    Measures how many times per second parse processes the whole output
+        * param parse: function with the signature of socket_haproxy.parse_stat
+        * param lines: see synthetic_stat
+        * rtype: float
+    '''
+    count = 0
+    start = time.time()
+    elapsed = 0.0
+    while elapsed < duration:
+        parse(lines)
+        count += 1
+        elapsed = time.time() - start
+    return count / elapsed
+
+
+def serve(path, lines):
+    '''
+    Fake HAProxy stats socket, in a daemon thread: supports the prompt mode
+    and answers 'show stat' with the given lines (and any other command
+    with an empty output)
+        * param path: path of the UNIX socket
+        * rtype: the listening socket (close it to stop accepting)
+    '''
+    output = '\n'.join(lines) + '\n\n'
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+
+    def handle(conn):
+        rbuf = ''
+        prompt = ''
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            rbuf += data
+            while '\n' in rbuf:
+                cmdline, rbuf = rbuf.split('\n', 1)
+                if cmdline == 'quit':
+                    conn.close()
+                    return
+                if cmdline == 'prompt':
+                    prompt = HAPROXY_CLI_PROMPT
+                    conn.sendall('\n' + prompt)
+                elif cmdline.startswith('show stat'):
+                    conn.sendall(output + prompt)
+                else:
+                    conn.sendall('\n' + prompt)
+        conn.close()
+
+    def run():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.error:
+                return # closed
+            handle(conn)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def legacy_recv(s):
+    '''
+    The receive path of sock.recv before the reusable buffer (the buffer
+    grows by concatenation, and is split one line at a time), for
+    comparison
+        * type s: socket_haproxy.sock
+        * rtype: generator of lines
+    '''
+    linecount = 0
+    rbuf = ''
+    while not rbuf.endswith(HAPROXY_CLI_PROMPT):
+
+        if linecount == HAPROXY_CLI_MAXLINES:
+            data = s._recv()
+            rbuf = rbuf[-(len(HAPROXY_CLI_PROMPT)-1):] + data
+            continue
+
+        data = s._recv()
+        rbuf += data
+
+        while linecount < HAPROXY_CLI_MAXLINES and '\n' in rbuf:
+            line, rbuf = rbuf.split('\n', 1)
+            linecount += 1
+            yield line
+
+
+def poll_rate(path, recv, parse=None, duration=1.0):
+    '''
+    Measures how many 'show stat' polls per second the socket performs
+        * param path: path of the UNIX socket, see serve
+        * param recv: function receiving the output, given the sock (e.g.,
+          legacy_recv or socket_haproxy.sock.recv)
+        * param parse: if not None, the function parsing the output (see
+          parse_rate), otherwise the lines are only received
+        * rtype: float
+    '''
+    s = socket_haproxy.sock(path)
+    s.connect()
+    try:
+        count = 0
+        start = time.time()
+        elapsed = 0.0
+        while elapsed < duration:
+            s.send('show stat')
+            if parse is None:
+                deque(recv(s), maxlen=0)
+            else:
+                parse(recv(s))
+            count += 1
+            elapsed = time.time() - start
+    finally:
+        s.close()
+    return count / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Statistics parsing micro-benchmark')
+    parser.add_argument('-s', type=int, required=False, default=5000,
+                        help='Number of servers [default 5000]')
+    parser.add_argument('-p', type=int, required=False, default=10,
+                        help='Number of proxies [default 10]')
+    parser.add_argument('-d', type=float, required=False, default=1.0,
+                        help='Seconds per measurement [default 1.0]')
+    parser.add_argument('-f', nargs='+', required=False, default=['act', 'scur', 'stot'],
+                        help='Fields parsed by StatParser [default act scur stot]')
+    parser.add_argument('-socket', action='store_true',
+                        help='Compares the receive paths on a fake HAProxy socket instead')
+    args = parser.parse_args()
+
+    lines = synthetic_stat(args.s, args.p)
+    if args.socket:
+        path = os.path.join(tempfile.mkdtemp(), 'haproxy')
+        server = serve(path, lines)
+        try:
+            parse = socket_haproxy.StatParser(args.f).parse
+            for name, recv in [('legacy', legacy_recv), ('recv_into', socket_haproxy.sock.recv)]:
+                received = poll_rate(path, recv, None, args.d)
+                parsed = poll_rate(path, recv, parse, args.d)
+                print '%-9s: receive %.2f ms per poll, receive and parse %.2f ms per poll' % (
+                    name, 1e3 / received, 1e3 / parsed)
+        finally:
+            server.close()
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+        raise SystemExit(0)
+
+    full = parse_rate(socket_haproxy.parse_stat, lines, args.d)
+    projected = parse_rate(socket_haproxy.StatParser(args.f).parse, lines, args.d)
+    print 'parse_stat: %.0f rows/sec., %.2f ms per poll' % (len(lines) * full, 1e3 / full)
+    print 'StatParser (%d fields): %.0f rows/sec., %.2f ms per poll, speed-up %.2f' % (
+        len(args.f), len(lines) * projected, 1e3 / projected, projected / full)
@@ -170,6 +170,7 @@ class Instance():
     - IP address
     - Launch time
     - state of the server (reserve or always on), ALWAYS_ON by default
+    - tier of the reserves the server belongs to (None if always on)
     '''
     def __init__(self, instance, state=ALWAYS_ON): #instance_id, ip_address, launch_time):
         '''
@@ -183,6 +184,7 @@ class Instance():
         self.ip_address = instance.ip_address #ip_address
         self.launch_time = extract_launch_time(instance.launch_time) #launch_time
         self.state = state
+        self.tier = None
         
         
     def __str__(self):
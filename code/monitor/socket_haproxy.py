@@ -26,6 +26,9 @@ http://feurix.org/projects/hatop/
 
 import re
 import socket
+from collections import namedtuple
+from itertools import chain
+from operator import itemgetter
 from socket import error as SocketError
 import time, sys, logging
 
@@ -53,7 +56,13 @@ HAPROXY_CLI_TIMEOUT = 100000
 HAPROXY_CLI_PROMPT = '> '
 HAPROXY_CLI_CMD_SEP = ';'
 HAPROXY_CLI_CMD_TIMEOUT = 1
-HAPROXY_CLI_MAXLINES = 1000
+HAPROXY_CLI_MAXLINES = 100000
+# Initial size of the receive buffer, see sock.recv_chunks
+HAPROXY_CLI_RBUF_SIZE = 65536
+# In prompt mode, the output of each command is followed by this string
+HAPROXY_CLI_RESULT_END = '\n' + HAPROXY_CLI_PROMPT
+# Max number of commands sent in a single write, see sock.execute
+HAPROXY_CLI_BATCH_MAX = 100
 
 # Settings of the embedded CLI
 CLI_MAXLINES = 1000
@@ -80,7 +89,6 @@ HAPROXY_INFO_RE = {
 'node':             re.compile('^node:\s*(?P<value>\S+)'),
 }
 
-HAPROXY_STAT_MAX_SERVICES = 100
 HAPROXY_STAT_COMMENT = '#'
 HAPROXY_STAT_SEP = ','
 HAPROXY_STAT_FILTER_RE = re.compile(
@@ -150,6 +158,8 @@ HAPROXY_STAT_CSV = [
 ]
 HAPROXY_STAT_NUMFIELDS = len(HAPROXY_STAT_CSV)
 HAPROXY_STAT_CSV = [(k, v) for k, v in enumerate(HAPROXY_STAT_CSV)]
+# Fields always parsed by StatParser, as they identify the rows
+HAPROXY_STAT_KEYS = ['pxname', 'svname', 'iid', 'sid', 'type']
 
 class sock:
     
@@ -157,6 +167,7 @@ class sock:
         self.path = path
         self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         self._socket.settimeout(1)
+        self._rbuf = bytearray(HAPROXY_CLI_RBUF_SIZE) # reused, see recv_chunks
         #self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         #self._socket.setblocking(0)
         #self._socket.setsockopt(socket.SOL_SOCKET, socket.TCP_NODELAY, 0)
@@ -207,6 +218,34 @@ class sock:
         '''
         return self._socket.send('%s\n' % cmdline)
 
+    def execute(self, commands):
+        '''
+        Runs several commands, pipelined: the commands are sent in a single
+        write (one per line, in batches of HAPROXY_CLI_BATCH_MAX), then the
+        output of each one is read back, up to its prompt. Unlike commands
+        separated by HAPROXY_CLI_CMD_SEP, the output of each command can be
+        told apart. Requires the prompt mode, see connect.
+            * type commands: list of strings
+            * rtype: list of strings, the output of each command, stripped
+              (empty on success for the commands that print nothing, e.g.,
+              enable/disable server and set weight)
+        '''
+        for cmdline in commands:
+            if '\n' in cmdline or HAPROXY_CLI_CMD_SEP in cmdline:
+                raise ValueError('one command expected, got: %s' % cmdline)
+        results = []
+        for i in xrange(0, len(commands), HAPROXY_CLI_BATCH_MAX):
+            batch = commands[i:i + HAPROXY_CLI_BATCH_MAX]
+            self._socket.sendall(''.join('%s\n' % cmdline for cmdline in batch))
+            expected = len(results) + len(batch)
+            rbuf = ''
+            while len(results) < expected:
+                rbuf += self._recv()
+                parts = rbuf.split(HAPROXY_CLI_RESULT_END)
+                results.extend(part.strip() for part in parts[:-1])
+                rbuf = parts[-1]
+        return results
+
     def wait(self):
         # Wait for the prompt and discard data.
         rbuf = ''
@@ -215,28 +254,65 @@ class sock:
             rbuf = rbuf[-(len(HAPROXY_CLI_PROMPT)-1):] + data
 
     def recv(self):
-        # Receive lines until HAPROXY_CLI_MAXLINES or the prompt is reached.
-        # If the prompt was still not found, discard data and wait for it.
-        linecount = 0
-        rbuf = ''
-        while not rbuf.endswith(HAPROXY_CLI_PROMPT):
-
-            if linecount == HAPROXY_CLI_MAXLINES:
-                data = self._recv()
-                rbuf = rbuf[-(len(HAPROXY_CLI_PROMPT)-1):] + data
-                continue
-
-            data = self._recv()
-            rbuf += data
+        '''
+        Receives the output of the last command, up to the prompt
+            * rtype: iterator of lines, see recv_chunks
+        '''
+        return chain.from_iterable(self.recv_chunks())
 
-            while linecount < HAPROXY_CLI_MAXLINES and '\n' in rbuf:
-                line, rbuf = rbuf.split('\n', 1)
-                linecount += 1
-                yield line
+    def recv_chunks(self):
+        '''
+        Receives the output of the last command, up to the prompt. The data
+        is read (recv_into) into a buffer reused across the calls, and only
+        the complete lines are copied out of it, once per read; lines
+        beyond HAPROXY_CLI_MAXLINES are discarded.
+            * rtype: generator of lists of lines, the complete lines
+              received by each read
+        '''
+        buf = self._rbuf
+        view = memoryview(buf)
+        start = end = 0 # pending (incomplete line) data is buf[start:end]
+        linecount = 0
+        while True:
+            if end == len(buf):
+                if start > 0:
+                    # move the incomplete line to the beginning
+                    buf[:end - start] = buf[start:end]
+                    end -= start
+                    start = 0
+                else:
+                    # line longer than the buffer
+                    buf = bytearray(2 * len(buf))
+                    buf[:end] = view
+                    self._rbuf = buf
+                    view = memoryview(buf)
+
+            count = self._socket.recv_into(view[end:])
+            if count == 0:
+                raise SocketError('error while waiting for prompt')
+            end += count
+
+            last = buf.rfind('\n', start, end) + 1
+            if last > start:
+                if linecount < HAPROXY_CLI_MAXLINES:
+                    lines = view[start:last - 1].tobytes().split('\n')
+                    if linecount + len(lines) > HAPROXY_CLI_MAXLINES:
+                        del lines[HAPROXY_CLI_MAXLINES - linecount:]
+                    linecount += len(lines)
+                    yield lines
+                start = last
+
+            if buf.endswith(HAPROXY_CLI_PROMPT, start, end):
+                return
 
 class SocketData:
 
-    def __init__(self, socket, socket_path=SOCKET_PATH):
+    def __init__(self, socket, socket_path=SOCKET_PATH, fields=None):
+        '''
+        * fields: if not None, only these fields are parsed (see
+          StatParser), and the stats are StatParser records instead of
+          dictionaries
+        '''
         self.socket = socket
         self.pxcount = 0
         self.svcount = 0
@@ -244,6 +320,9 @@ class SocketData:
         self.stat = {}
         self._filters = set()
         self.socket_path = socket_path
+        self._parse_stat = parse_stat
+        if fields is not None:
+            self._parse_stat = StatParser(fields).parse
 
     def register_stat_filter(self, stat_filter):
 
@@ -269,7 +348,7 @@ class SocketData:
 
         # Convert proxy filters into more efficient stat filters
         self.socket.send('show stat')
-        pxstat, pxcount, svcount = parse_stat(self.socket.recv())
+        pxstat, pxcount, svcount = self._parse_stat(self.socket.recv())
 
         proxy_iid_map = {} # {pxname: iid, ...}
 
@@ -290,6 +369,17 @@ class SocketData:
         for iid in proxy_iid_map.itervalues():
             self._filters.add((iid, -1, -1))
 
+    def get_servers(self, iid):
+        '''
+        Gets the statistics of the servers (type 2 rows) of a proxy; they
+        are available only if requested by the stat filters (type 4)
+            * param iid: the proxy identifier
+            * rtype: list, sorted by service identifier
+        '''
+        services = self.stat.get(iid, {})
+        return [services[sid] for sid in sorted(services)
+                if services[sid]['type'] == 2]
+
     def update_info(self):
         self.socket.send('show info')
         iterable = self.socket.recv()
@@ -326,7 +416,7 @@ class SocketData:
             for filter in self._filters:
                 self.socket.send('show stat %d %d %d' % filter)
                 filter_stat, filter_pxcount, filter_svcount = \
-                        parse_stat(self.socket.recv())
+                        self._parse_stat(self.socket.recv())
 
                 if filter_pxcount == 0:
                     #raise RuntimeError('stale stat filter: %d %d %d' % filter)
@@ -341,7 +431,7 @@ class SocketData:
             print 'showing stat'
             self.socket.send('show stat')
             self.stat, self.pxcount, self.svcount = \
-                    parse_stat(self.socket.recv())
+                    self._parse_stat(self.socket.recv())
 
         # deal with HAProxy reconfiguration reload
         if self.pxcount == 0:
@@ -377,45 +467,129 @@ def get_idx(field):
     return filter(lambda x: x[1][1] == field, HAPROXY_STAT_CSV)[0][0]
 
 
+HAPROXY_STAT_IDX = dict((field[1], idx) for idx, field in HAPROXY_STAT_CSV)
+
+
+def _record_type(fields):
+    '''
+    Creates the type of the records returned by StatParser: a named tuple
+    that can also be indexed by field name, like the dictionaries returned
+    by parse_stat
+    '''
+    base = namedtuple('StatRecord', fields)
+
+    class StatRecord(base):
+        __slots__ = ()
+
+        def __getitem__(self, key):
+            if isinstance(key, basestring):
+                try:
+                    return getattr(self, key)
+                except AttributeError:
+                    raise KeyError(key)
+            return base.__getitem__(self, key)
+
+    return StatRecord
+
+
+class StatParser:
+    '''
+    Parser of the output of 'show stat' that converts only the given
+    fields. The column indices and the converters are computed once, and
+    each row becomes a tuple (see _record_type) rather than a dictionary
+    with all the HAPROXY_STAT_NUMFIELDS fields. The fields in
+    HAPROXY_STAT_KEYS are always included.
+    '''
+
+    def __init__(self, fields):
+        names = list(HAPROXY_STAT_KEYS)
+        for field in fields:
+            if field not in HAPROXY_STAT_IDX:
+                raise ValueError('unknown stat field: %s' % field)
+            if field not in names:
+                names.append(field)
+        self.fields = names
+        self.record = _record_type(names)
+        self._getter = itemgetter(*[HAPROXY_STAT_IDX[field] for field in names])
+        # positions of the integer fields, converted after the projection
+        self._ints = [pos for pos, field in enumerate(names)
+                      if HAPROXY_STAT_CSV[HAPROXY_STAT_IDX[field]][1][0] is int]
+        self._pos_status = names.index('status') if 'status' in names else None
+        self._pos_check = names.index('check_status') if 'check_status' in names else None
+        self._idx_status = HAPROXY_STAT_IDX['status']
+
+    def parse(self, iterable):
+        '''
+        Same as parse_stat, but the stats are records of the given fields
+            * rtype: tuple (pxstat, pxcount, svcount)
+        '''
+        pxcount = svcount = 0
+        pxstat = {} # {iid: {sid: record, ...}, ...}
+        names = self.fields
+        getter = self._getter
+        ints = self._ints
+        record = self.record
+        pos_status = self._pos_status
+        pos_check = self._pos_check
+        new = tuple.__new__
+
+        for line in iterable:
+            if not line:
+                continue
+            if line.startswith(HAPROXY_STAT_COMMENT):
+                continue # comment
+
+            csv = line.split(HAPROXY_STAT_SEP, HAPROXY_STAT_NUMFIELDS)
+            if len(csv) <= HAPROXY_STAT_NUMFIELDS:
+                continue # unknown format
+
+            values = list(getter(csv))
+            try:
+                for pos in ints:
+                    value = values[pos]
+                    values[pos] = int(value, 10) if value else 0
+            except ValueError:
+                raise RuntimeError('garbage field: %s="%s" (need %s)' % (
+                        names[pos], value, int))
+
+            # Special case
+            if pos_status is not None and values[pos_status] == 'no check':
+                values[pos_status] = '-'
+            if pos_check is not None and csv[self._idx_status] in ('no check', '-'):
+                values[pos_check] = 'none'
+
+            svstat = new(record, values)
+
+            # Record result... (the first fields are HAPROXY_STAT_KEYS)
+            iid = values[2]
+            if values[4] == 0 or values[4] == 1:  # FRONTEND / BACKEND
+                id = values[1]
+            else:
+                id = values[3]
+
+            try:
+                pxstat[iid][id] = svstat
+            except KeyError:
+                pxstat[iid] = { id: svstat }
+                pxcount += 1
+            svcount += 1
+
+        return pxstat, pxcount, svcount
+
+
 def parse_stat(iterable):
     pxcount = svcount = 0
     pxstat = {} # {iid: {sid: svstat, ...}, ...}
 
-    idx_iid = get_idx('iid')
-    idx_sid = get_idx('sid')
-
     for line in iterable:
         if not line:
             continue
         if line.startswith(HAPROXY_STAT_COMMENT):
             continue # comment
-        if line.count(HAPROXY_STAT_SEP) < HAPROXY_STAT_NUMFIELDS:
-            continue # unknown format
 
         csv = line.split(HAPROXY_STAT_SEP, HAPROXY_STAT_NUMFIELDS)
-
-        # Skip further parsing?
-        if svcount > HAPROXY_STAT_MAX_SERVICES:
-            try:
-                iid = csv[idx_iid]
-                iid = int(iid, 10)
-            except ValueError:
-                raise RuntimeError(
-                        'garbage proxy identifier: iid="%s" (need %s)' %
-                        (iid, int))
-            try:
-                sid = csv[idx_sid]
-                sid = int(sid, 10)
-            except ValueError:
-                raise RuntimeError(
-                        'garbage service identifier: sid="%s" (need %s)' %
-                        (sid, int))
-            if iid not in pxstat:
-                pxcount += 1
-                svcount += 1
-            elif sid not in pxstat[iid]:
-                svcount += 1
-            continue
+        if len(csv) <= HAPROXY_STAT_NUMFIELDS:
+            continue # unknown format
 
         # Parse stat...
         svstat = {} # {field: value, ...}